@@ -0,0 +1,40 @@
+"""Add task type change notification
+
+Revision ID: a3c9e4f17b82
+Revises: 7f2a0c5e9b16
+Create Date: 2026-10-18 16:02:11.547309+00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "a3c9e4f17b82"
+down_revision = "7f2a0c5e9b16"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE FUNCTION notify_task_type_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('task_type_changes', '');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER task_type_change
+        AFTER INSERT OR UPDATE OR DELETE ON task_types
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_task_type_change()
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER task_type_change ON task_types")
+    op.execute("DROP FUNCTION notify_task_type_change()")
@@ -0,0 +1,40 @@
+"""Add task change notification
+
+Revision ID: d41e6b8c7a53
+Revises: 5c1d7a9e0f24
+Create Date: 2026-10-18 13:41:52.068473+00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "d41e6b8c7a53"
+down_revision = "5c1d7a9e0f24"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE FUNCTION notify_task_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('task_changes', NEW.id::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER task_change
+        AFTER INSERT OR UPDATE OF time, worker_id, timeliness ON tasks
+        FOR EACH ROW EXECUTE FUNCTION notify_task_change()
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER task_change ON tasks")
+    op.execute("DROP FUNCTION notify_task_change()")
@@ -0,0 +1,120 @@
+"""Measure contention of workers taking the same task at once.
+
+In each round all workers claim one new task simultaneously, the way
+they tap the button of the same offer. Latency of claims and claims per
+second are reported, and each round is checked to have exactly one
+winner. Temporary users, workers and tasks are created in database
+configured by ``DATABASE_*`` options. Simultaneous claims are limited
+by the connection pool, so raise ``DATABASE_MAX_OVERFLOW`` to measure
+contention of the database rather than of the pool.
+
+Usage: ``python -m benchmarks.claim [--workers N] [--rounds N]``
+"""
+import argparse
+import asyncio
+import datetime
+import statistics
+import time
+import typing
+
+import sqlalchemy as sa
+
+from cradlex import database
+from cradlex import models
+from cradlex.handlers.worker import claim_task
+
+
+#: ID of the first temporary user created in database.
+FIRST_WORKER_ID = 920000000
+
+
+async def timed_claim(worker_id: int, task_id: str) -> float:
+    started = time.perf_counter()
+    await claim_task(worker_id, task_id)
+    return time.perf_counter() - started
+
+
+async def run_round(worker_ids: typing.List[int]) -> typing.List[float]:
+    """Let all workers claim a new task and get latencies of claims."""
+    async with database.sessionmaker.begin() as session:
+        task_id = await session.scalar(
+            sa.insert(models.Task)
+            .values(
+                time=datetime.datetime.now(datetime.timezone.utc)
+                + datetime.timedelta(hours=1)
+            )
+            .returning(models.Task.id)
+        )
+    latencies = await asyncio.gather(
+        *(timed_claim(worker_id, task_id) for worker_id in worker_ids)
+    )
+    async with database.sessionmaker.begin() as session:
+        winners = await session.scalar(
+            sa.select(sa.func.count()).where(models.Worker.task_id == task_id)
+        )
+        await session.execute(
+            sa.update(models.Worker)
+            .values(task_id=None)
+            .where(models.Worker.task_id == task_id)
+        )
+    if winners != 1:
+        raise RuntimeError(f"Task {task_id} is taken by {winners} workers")
+    return latencies
+
+
+async def main(workers: int, rounds: int) -> None:
+    worker_ids = [FIRST_WORKER_ID + offset for offset in range(workers)]
+    async with database.sessionmaker.begin() as session:
+        await session.execute(
+            sa.insert(models.User).values(
+                [
+                    {"id": worker_id, "first_name": "Benchmark"}
+                    for worker_id in worker_ids
+                ]
+            )
+        )
+        await session.execute(
+            sa.insert(models.Worker).values(
+                [
+                    {
+                        "id": worker_id,
+                        "phone": f"+7901{worker_id % 10000000:07d}",
+                        "name": "Benchmark",
+                        "skill": "no_repair",
+                    }
+                    for worker_id in worker_ids
+                ]
+            )
+        )
+    try:
+        latencies: typing.List[float] = []
+        started = time.perf_counter()
+        for _round in range(rounds):
+            latencies += await run_round(worker_ids)
+        elapsed = time.perf_counter() - started
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"claims: {len(latencies)} in {elapsed:.2f} s")
+        print(f"claims/s: {len(latencies) / elapsed:.0f}")
+        print(f"latency p50: {quantiles[49] * 1000:.1f} ms")
+        print(f"latency p99: {quantiles[98] * 1000:.1f} ms")
+        print(f"latency max: {max(latencies) * 1000:.1f} ms")
+    finally:
+        async with database.sessionmaker.begin() as session:
+            await session.execute(
+                sa.delete(models.Task).where(models.Task.worker_id.in_(worker_ids))
+            )
+            await session.execute(
+                sa.delete(models.Worker).where(models.Worker.id.in_(worker_ids))
+            )
+            await session.execute(
+                sa.delete(models.User).where(models.User.id.in_(worker_ids))
+            )
+        await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=10)
+    arguments = parser.parse_args()
+    asyncio.run(main(arguments.workers, arguments.rounds))
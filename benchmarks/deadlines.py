@@ -0,0 +1,160 @@
+"""Measure cost of scheduler queries with a large history of tasks.
+
+Finished tasks are inserted as history along with a few pending ones of
+each kind: unverified, unstarted and waiting for the next wave. Query
+plans of full reload of deadlines and of claiming due tasks are printed
+and reload is timed. Temporary user, worker and tasks are created in
+database configured by ``DATABASE_*`` options.
+
+Usage: ``python -m benchmarks.deadlines [--history N] [--pending N]``
+"""
+import argparse
+import asyncio
+import datetime
+import time
+
+import sqlalchemy as sa
+
+from cradlex import database
+from cradlex import models
+from cradlex import scheduler
+
+
+WORKER_ID = 930000000
+#: Comment of temporary tasks.
+COMMENT = "benchmark"
+#: Tasks inserted or deleted by one statement.
+INSERT_BATCH_SIZE = 100000
+#: Number of timed reloads of deadlines.
+RELOADS = 10
+
+
+def insert_tasks(count: int, **values) -> sa.sql.Insert:
+    """Get statement inserting ``count`` tasks due one minute apart from
+    now in the past or future depending on sign of ``count``."""
+    number = sa.func.generate_series(1, abs(count)).column_valued("number")
+    columns = {
+        "time": sa.func.current_timestamp()
+        + sa.func.make_interval(0, 0, 0, 0, 0, number * (1 if count > 0 else -1)),
+        "comment": sa.literal(COMMENT),
+        **{
+            key: sa.literal(value, models.Task.__table__.c[key].type)
+            for key, value in values.items()
+        },
+    }
+    return sa.insert(models.Task).from_select(
+        list(columns), sa.select(*columns.values())
+    )
+
+
+async def explain(session, query: sa.sql.Select) -> str:
+    compiled = query.compile(dialect=database.engine.dialect)
+    connection = await session.connection()
+    cursor = await connection.exec_driver_sql(
+        f"EXPLAIN (ANALYZE, BUFFERS) {compiled}",
+        tuple(compiled.params[name] for name in compiled.positiontup),
+    )
+    return "\n".join(row[0] for row in cursor)
+
+
+async def main(history: int, pending: int) -> None:
+    async with database.sessionmaker.begin() as session:
+        await session.execute(
+            sa.insert(models.User).values(id=WORKER_ID, first_name="Benchmark")
+        )
+        await session.execute(
+            sa.insert(models.Worker).values(
+                id=WORKER_ID, phone="+79020000000", name="Benchmark", skill="no_repair"
+            )
+        )
+    try:
+        started = time.perf_counter()
+        for offset in range(0, history, INSERT_BATCH_SIZE):
+            async with database.sessionmaker.begin() as session:
+                await session.execute(
+                    insert_tasks(
+                        -min(INSERT_BATCH_SIZE, history - offset),
+                        worker_id=WORKER_ID,
+                        timeliness="on_time",
+                        sent=True,
+                    )
+                )
+        async with database.sessionmaker.begin() as session:
+            await session.execute(insert_tasks(pending, worker_id=WORKER_ID))
+            await session.execute(
+                insert_tasks(
+                    pending, worker_id=WORKER_ID, timeliness="on_time", sent=False
+                )
+            )
+            await session.execute(
+                insert_tasks(
+                    pending,
+                    next_wave_at=datetime.datetime.now(datetime.timezone.utc),
+                )
+            )
+        async with database.engine.connect() as connection:
+            await connection.execute(sa.text("ANALYZE tasks"))
+        print(f"inserted in {time.perf_counter() - started:.1f} s")
+        async with database.sessionmaker.begin() as session:
+            print("\nReload of all deadlines:")
+            print(
+                await explain(
+                    session, sa.select(models.Task.id).where(scheduler.pending())
+                )
+            )
+            for name, conditions in (
+                ("unverified", scheduler.unverified()),
+                ("unstarted", scheduler.unstarted()),
+            ):
+                print(f"\nClaim of {name} tasks:")
+                print(
+                    await explain(
+                        session,
+                        sa.select(models.Task.id)
+                        .where(*conditions)
+                        .order_by(models.Task.time)
+                        .limit(100),
+                    )
+                )
+        started = time.perf_counter()
+        for _reload in range(RELOADS):
+            scheduler.deadlines.clear()
+            scheduler.scheduled.clear()
+            await scheduler.load_deadlines()
+        elapsed = (time.perf_counter() - started) / RELOADS
+        print(
+            f"\nreload of {len(scheduler.deadlines)} deadlines: "
+            f"{elapsed * 1000:.1f} ms"
+        )
+    finally:
+        # History is deleted in batches, so that no statement runs longer
+        # than DATABASE_COMMAND_TIMEOUT.
+        for _offset in range(0, history + 3 * pending, INSERT_BATCH_SIZE):
+            async with database.sessionmaker.begin() as session:
+                await session.execute(
+                    sa.delete(models.Task)
+                    .where(
+                        models.Task.id.in_(
+                            sa.select(models.Task.id)
+                            .where(models.Task.comment == COMMENT)
+                            .limit(INSERT_BATCH_SIZE)
+                        )
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+        async with database.sessionmaker.begin() as session:
+            await session.execute(
+                sa.delete(models.Worker).where(models.Worker.id == WORKER_ID)
+            )
+            await session.execute(
+                sa.delete(models.User).where(models.User.id == WORKER_ID)
+            )
+        await database.engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history", type=int, default=1000000)
+    parser.add_argument("--pending", type=int, default=1000)
+    arguments = parser.parse_args()
+    asyncio.run(main(arguments.history, arguments.pending))
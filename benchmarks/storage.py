@@ -0,0 +1,95 @@
+"""Compare throughput of FSM storage backends.
+
+Every backend is called the way one update of a user in a conversation
+calls it: state and data are read, then state is set and data updated.
+PostgreStorage is measured only with ``--postgres`` and uses database
+configured by ``DATABASE_*`` options, where temporary users are created.
+It is measured both unbuffered and buffering changes of each update the
+way StorageMiddleware does.
+
+Usage: ``python -m benchmarks.storage [--users N] [--updates N] [--postgres]``
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+import typing
+
+import sqlalchemy as sa
+from aiogram.dispatcher.storage import BaseStorage
+
+from cradlex import database
+from cradlex import models
+from cradlex.storage import SnapshotMemoryStorage
+from cradlex.storage import SQLiteStorage
+
+
+#: ID of the first temporary user created in database.
+FIRST_USER_ID = 910000000
+
+
+async def process_update(storage, user: int, number: int) -> None:
+    await storage.get_state(chat=user, user=user)
+    await storage.get_data(chat=user, user=user)
+    await storage.set_state(chat=user, user=user, state=f"Form:step{number % 5}")
+    await storage.update_data(chat=user, user=user, step=number, text="x" * 32)
+
+
+async def measure(storage, users: int, updates: int, buffered: bool) -> float:
+    """Process ``updates`` for each of ``users`` concurrently and get
+    processed updates per second."""
+
+    async def converse(user: int) -> None:
+        for number in range(updates):
+            if buffered:
+                await storage.begin_update(user)
+            await process_update(storage, user, number)
+            if buffered:
+                await storage.finish_update()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(converse(FIRST_USER_ID + offset) for offset in range(users)))
+    return users * updates / (time.perf_counter() - started)
+
+
+async def main(users: int, updates: int, postgres: bool) -> None:
+    directory = tempfile.TemporaryDirectory()
+    backends: typing.Dict[str, typing.Callable[[], BaseStorage]] = {
+        "memory": SnapshotMemoryStorage,
+        "snapshot": lambda: SnapshotMemoryStorage(directory.name + "/snapshot.json"),
+        "sqlite": lambda: SQLiteStorage(directory.name + "/storage.sqlite"),
+    }
+    user_ids = [FIRST_USER_ID + offset for offset in range(users)]
+    if postgres:
+        backends["postgres"] = database.PostgreStorage
+        backends["buffered"] = database.PostgreStorage
+        async with database.sessionmaker.begin() as session:
+            await session.execute(
+                sa.insert(models.User).values(
+                    [{"id": user_id, "first_name": "Benchmark"} for user_id in user_ids]
+                )
+            )
+    try:
+        for name, create in backends.items():
+            storage = create()
+            rate = await measure(storage, users, updates, name == "buffered")
+            await storage.close()
+            await storage.wait_closed()
+            print(f"{name:>10}: {rate:10.0f} updates/s")
+    finally:
+        if postgres:
+            async with database.sessionmaker.begin() as session:
+                await session.execute(
+                    sa.delete(models.User).where(models.User.id.in_(user_ids))
+                )
+            await database.engine.dispose()
+        directory.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=50)
+    parser.add_argument("--postgres", action="store_true")
+    arguments = parser.parse_args()
+    asyncio.run(main(arguments.users, arguments.updates, arguments.postgres))
@@ -4,12 +4,15 @@ from aiogram import Dispatcher
 from cradlex import config
 from cradlex import database
 from cradlex.i18n import i18n
+from cradlex.storage import create_storage
 from cradlex.user import user_middleware
 
 with open(config.TOKEN_FILENAME, "r") as token_file:
     bot = Bot(token_file.read().strip())
 
-dp = Dispatcher(bot)
-dp.storage = database.PostgreStorage()
+dp = Dispatcher(bot, storage=create_storage())
+dp.middleware.setup(database.SessionMiddleware())
 dp.middleware.setup(user_middleware)
+if isinstance(dp.storage, database.PostgreStorage):
+    dp.middleware.setup(database.StorageMiddleware())
 dp.middleware.setup(i18n)
@@ -0,0 +1,49 @@
+import collections
+import time
+import typing
+
+
+KT = typing.TypeVar("KT")
+VT = typing.TypeVar("VT")
+
+
+class LRUCache(typing.Generic[KT, VT]):
+    """Mapping with limited size and lifetime of items.
+
+    If cache is full, least recently used item is discarded. Items are
+    discarded after ``ttl`` seconds since they were set.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items: typing.OrderedDict[
+            KT, typing.Tuple[float, VT]
+        ] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get(self, key: KT) -> typing.Optional[VT]:
+        item = self.items.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires <= time.monotonic():
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return value
+
+    def set(self, key: KT, value: VT) -> None:
+        self.items[key] = (time.monotonic() + self.ttl, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def pop(self, key: KT) -> typing.Optional[VT]:
+        item = self.items.pop(key, None)
+        return None if item is None else item[1]
+
+    def clear(self) -> None:
+        self.items.clear()
@@ -4,3 +4,4 @@ edit_task_step = CallbackData("edit_task_step", "step")
 edit_worker_step = CallbackData("edit_worker_step", "step")
 take_task = CallbackData("take_task", "task_id")
 review_task = CallbackData("check_task", "task_id", "review")
+cancel_task = CallbackData("cancel_task", "task_id")
@@ -0,0 +1,92 @@
+import typing
+
+import sqlalchemy as sa
+
+from cradlex import database
+from cradlex import models
+
+
+#: Channel notified by database trigger when task types are changed.
+TASK_TYPE_CHANNEL = "task_type_changes"
+
+
+class TaskTypeCatalog:
+    """In-memory catalog of task types.
+
+    Catalog is changed by handlers when their changes are committed and
+    reloaded when task types are changed by other processes. ``version``
+    is incremented on every change.
+    """
+
+    def __init__(self):
+        self.task_types: typing.Dict[str, models.TaskType] = {}
+        self.version = 0
+        self.stale = False
+
+    def replace(self, task_types: typing.Iterable[models.TaskType]) -> None:
+        self.task_types = {task_type.id: task_type for task_type in task_types}
+        self.version += 1
+
+    def add(self, task_type: models.TaskType) -> None:
+        self.task_types[task_type.id] = task_type
+        self.version += 1
+
+    def remove(self, task_type_id: str) -> None:
+        if self.task_types.pop(task_type_id, None) is not None:
+            self.version += 1
+
+    async def load(self) -> None:
+        # Reloads follow notifications sent by primary on commit, which
+        # a lagging replica might not have applied yet.
+        async with database.transaction() as session:
+            cursor = await session.execute(sa.select(models.TaskType))
+            self.replace(cursor.scalars().all())
+
+    async def get(self, task_type_id: str) -> models.TaskType:
+        """Get task type by ID, loading it if it is not in catalog yet.
+
+        Raise ``KeyError`` if there is no such task type.
+        """
+        task_type = self.task_types.get(task_type_id)
+        if task_type is not None:
+            return task_type
+        async with database.transaction() as session:
+            task_type = await session.get(models.TaskType, task_type_id)
+            if task_type is None:
+                raise KeyError(task_type_id)
+            session.expunge(task_type)
+        self.add(task_type)
+        return task_type
+
+    def all(self) -> typing.List[models.TaskType]:
+        """Get all task types sorted by difficulty and name."""
+        return sorted(
+            self.task_types.values(),
+            key=lambda task_type: (
+                models.TASK_DIFFICULTY.index(task_type.difficulty),
+                task_type.name,
+            ),
+        )
+
+    def find(self, name: str, difficulty: str) -> typing.Optional[models.TaskType]:
+        for task_type in self.task_types.values():
+            if task_type.name == name and task_type.difficulty == difficulty:
+                return task_type
+        return None
+
+    def on_change(self, payload: str) -> None:
+        self.stale = True
+
+    async def sync(self, reconnected: bool) -> None:
+        if reconnected or self.stale:
+            self.stale = False
+            await self.load()
+
+    async def run(self) -> None:
+        """Reload catalog on database notifications until cancelled."""
+        await database.follow(
+            TASK_TYPE_CHANNEL, self.on_change, self.sync, "reloading task types"
+        )
+
+
+catalog = TaskTypeCatalog()
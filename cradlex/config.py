@@ -10,7 +10,38 @@ DEFAULT_VALUES = {
     "DATABASE_HOST": "127.0.0.1",
     "DATABASE_PORT": 5432,
     "DATABASE_NAME": "cradlex",
+    "DATABASE_REPLICA_PORT": 5432,
+    "DATABASE_POOL_SIZE": 10,
+    "DATABASE_MAX_OVERFLOW": 20,
+    "DATABASE_POOL_TIMEOUT": 30,
+    "DATABASE_POOL_RECYCLE": 1800,
+    "DATABASE_POOL_PRE_PING": True,
+    "DATABASE_STATEMENT_CACHE_SIZE": 100,
+    "DATABASE_COMMAND_TIMEOUT": 60,
+    "DATABASE_PGBOUNCER": False,
     "SKIP_UPDATES": False,
+    "USER_CACHE_SIZE": 10000,
+    "USER_CACHE_TTL": 3600,
+    "STORAGE": "postgres",
+    "STORAGE_SNAPSHOT_INTERVAL": 60,
+    "STORAGE_CACHE_SIZE": 10000,
+    "STORAGE_CACHE_TTL": 600,
+    "SEND_GLOBAL_RATE": 30,
+    "SEND_CHAT_RATE": 1,
+    "SEND_CONCURRENCY": 30,
+    "OUTBOX_WORKERS": 4,
+    "OUTBOX_BATCH_SIZE": 30,
+    "OUTBOX_LEASE": 60,
+    "OUTBOX_POLL_INTERVAL": 5,
+    "OUTBOX_MAX_ATTEMPTS": 5,
+    "OUTBOX_RETRY_DELAY": 5,
+    "OUTBOX_MAX_RETRY_DELAY": 600,
+    "SCHEDULER_RESYNC_INTERVAL": 3600,
+    "SCHEDULER_BATCH_SIZE": 100,
+    "SCHEDULER_SWEEP_INTERVAL": 600,
+    "SCHEDULER_RELEASE_DELAY": 86400,
+    "DISPATCH_WAVE_SIZE": 10,
+    "DISPATCH_WAVE_TIMEOUT": 120,
 }
 
 
@@ -1,99 +1,505 @@
-import json
+import asyncio
+import contextlib
+import contextvars
+import copy
+import logging
+import sys
+import time
+import typing
 from string import Template
 
+import asyncpg
 import sqlalchemy as sa
 import sqlalchemy.ext.asyncio
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.dispatcher.storage import BaseStorage
+from sqlalchemy.dialects.postgresql import JSONB
 
 from cradlex import config
+from cradlex import metrics
 from cradlex import models
+from cradlex.cache import LRUCache
 
 
 URL_TEMPLATE = Template(
     Template("postgresql+asyncpg://$auth@$host:$port/$name").safe_substitute(
-        host=config.DATABASE_HOST,
-        port=config.DATABASE_PORT,
         name=config.DATABASE_NAME,
     )
 )
 try:
     with open(config.DATABASE_PASSWORD_FILENAME, "r") as password_file:
-        URL = URL_TEMPLATE.substitute(
-            auth=f"{config.DATABASE_USERNAME}:{password_file.read().strip()}"
-        )
+        AUTH = f"{config.DATABASE_USERNAME}:{password_file.read().strip()}"
 except (AttributeError, FileNotFoundError):
-    URL = URL_TEMPLATE.substitute(auth=f"{config.DATABASE_USERNAME}")
+    AUTH = f"{config.DATABASE_USERNAME}"
+URL = URL_TEMPLATE.substitute(
+    auth=AUTH, host=config.DATABASE_HOST, port=config.DATABASE_PORT
+)
+try:
+    REPLICA_URL: typing.Optional[str] = URL_TEMPLATE.substitute(
+        auth=AUTH,
+        host=config.DATABASE_REPLICA_HOST,
+        port=config.DATABASE_REPLICA_PORT,
+    )
+except AttributeError:
+    REPLICA_URL = None
+
+#: Seconds to use primary database instead of unavailable read replica.
+REPLICA_RETRY_DELAY = 30
+
+if config.DATABASE_PGBOUNCER:
+    STATEMENT_CACHE_SIZE = 0
+else:
+    STATEMENT_CACHE_SIZE = config.DATABASE_STATEMENT_CACHE_SIZE
+
+
+def create_engine(url: str) -> sa.ext.asyncio.AsyncEngine:
+    return sa.ext.asyncio.create_async_engine(
+        url,
+        pool_size=config.DATABASE_POOL_SIZE,
+        max_overflow=config.DATABASE_MAX_OVERFLOW,
+        pool_timeout=config.DATABASE_POOL_TIMEOUT,
+        pool_recycle=config.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=config.DATABASE_POOL_PRE_PING,
+        connect_args={
+            "command_timeout": config.DATABASE_COMMAND_TIMEOUT,
+            "statement_cache_size": STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": STATEMENT_CACHE_SIZE,
+        },
+    )
 
 
-engine = sa.ext.asyncio.create_async_engine(URL)
+engine = create_engine(URL)
 sessionmaker = sa.orm.sessionmaker(
     engine,
     expire_on_commit=False,
     class_=sa.ext.asyncio.AsyncSession,
 )
+if REPLICA_URL is not None:
+    replica_sessionmaker: typing.Optional[sa.orm.sessionmaker] = sa.orm.sessionmaker(
+        create_engine(REPLICA_URL),
+        expire_on_commit=False,
+        class_=sa.ext.asyncio.AsyncSession,
+    )
+else:
+    replica_sessionmaker = None
+#: Time until which read replica is not used after it failed.
+replica_down_until = 0.0
+
+
+def engine_settings() -> str:
+    """Describe settings of connection pool for logging."""
+    return (
+        f"pool size {config.DATABASE_POOL_SIZE}, "
+        f"max overflow {config.DATABASE_MAX_OVERFLOW}, "
+        f"pool timeout {config.DATABASE_POOL_TIMEOUT}s, "
+        f"pool recycle {config.DATABASE_POOL_RECYCLE}s, "
+        f"pre-ping {config.DATABASE_POOL_PRE_PING}, "
+        f"statement cache size {STATEMENT_CACHE_SIZE}, "
+        f"command timeout {config.DATABASE_COMMAND_TIMEOUT}s, "
+        f"PgBouncer mode {config.DATABASE_PGBOUNCER}, "
+        f"read replica {'enabled' if REPLICA_URL else 'disabled'}"
+    )
+
+
+#: Seconds between checks of notification connections.
+LISTEN_CHECK_INTERVAL = 60
+#: Seconds to wait before reconnecting after an error.
+LISTEN_ERROR_DELAY = 5
+
+update_session: contextvars.ContextVar[
+    typing.Optional[sa.ext.asyncio.AsyncSession]
+] = contextvars.ContextVar("update_session", default=None)
+
+
+async def checkout(session: sa.ext.asyncio.AsyncSession) -> None:
+    """Acquire connection of ``session`` measuring time of waiting for it.
+
+    Number of checkouts and total time of waiting in milliseconds are
+    exposed as ``database.checkouts`` and ``database.checkout_ms``
+    metrics.
+    """
+    start = time.monotonic()
+    await session.connection()
+    metrics.increment("database.checkouts")
+    metrics.increment("database.checkout_ms", round((time.monotonic() - start) * 1000))
+
+
+@contextlib.asynccontextmanager
+async def transaction() -> typing.AsyncIterator[sa.ext.asyncio.AsyncSession]:
+    """Get session in transaction.
+
+    During processing of update session of the update is returned, so
+    that the whole update uses one connection and is committed at once
+    by ``SessionMiddleware``. Otherwise new session is committed on exit.
+    """
+    session = update_session.get()
+    if session is None:
+        async with sessionmaker() as session:
+            async with session.begin():
+                await checkout(session)
+                yield session
+        return
+    if not session.in_transaction():
+        await checkout(session)
+    yield session
+    await session.flush()
+
+
+@contextlib.asynccontextmanager
+async def readonly() -> typing.AsyncIterator[sa.ext.asyncio.AsyncSession]:
+    """Get session for read-only queries.
+
+    Session is connected to read replica if it is configured and
+    available or to primary database otherwise. Replica may lag behind
+    primary, so data which must reflect the latest changes should be
+    read with ``transaction()``.
+    """
+    global replica_down_until
+    if replica_sessionmaker is not None and time.monotonic() >= replica_down_until:
+        async with replica_sessionmaker() as session:
+            try:
+                await checkout(session)
+            except (OSError, asyncio.TimeoutError, sa.exc.DBAPIError) as error:
+                replica_down_until = time.monotonic() + REPLICA_RETRY_DELAY
+                logging.getLogger(__name__).error(
+                    f"Read replica is unavailable, using primary: {error}"
+                )
+            else:
+                yield session
+                return
+    async with transaction() as session:
+        yield session
+
+
+def on_commit(
+    session: sa.ext.asyncio.AsyncSession, callback: typing.Callable[[], None]
+) -> None:
+    """Call ``callback`` after transaction of ``session`` is committed."""
+    session.info.setdefault("on_commit", []).append(callback)
+
+
+@sa.event.listens_for(sa.orm.Session, "after_commit")
+def call_commit_callbacks(session: sa.orm.Session) -> None:
+    for callback in session.info.pop("on_commit", []):
+        callback()
+
+
+@sa.event.listens_for(sa.orm.Session, "after_rollback")
+def forget_commit_callbacks(session: sa.orm.Session) -> None:
+    session.info.pop("on_commit", None)
+
+
+class SessionMiddleware(BaseMiddleware):
+    """Share one database session between everything processing update.
+
+    Session is committed after update is processed or rolled back if
+    processing failed.
+    """
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        update_session.set(sessionmaker())
+
+    async def on_pre_process_error(
+        self, update: types.Update, exception: Exception, data: dict
+    ):
+        # Exceptions are handled by errors handlers before the update is
+        # post-processed, so failure has to be recorded here.
+        session = update_session.get()
+        if session is not None:
+            session.info["failed"] = True
+
+    async def on_post_process_update(
+        self, update: types.Update, results: list, data: dict
+    ):
+        session = update_session.get()
+        if session is None:
+            return
+        update_session.set(None)
+        try:
+            if session.info.pop("failed", False) or sys.exc_info()[1] is not None:
+                await session.rollback()
+            else:
+                await session.commit()
+        finally:
+            await session.close()
+
+
+async def listen(
+    channel: str, callback: typing.Callable[[str], None]
+) -> asyncpg.Connection:
+    """Call ``callback`` with payload of every notification on ``channel``.
+
+    Notifications are received on a dedicated connection which is
+    returned to be checked and closed by caller.
+    """
+    connection = await asyncpg.connect(
+        engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    )
+    await connection.add_listener(
+        channel, lambda connection, pid, channel, payload: callback(payload)
+    )
+    return connection
+
+
+async def follow(
+    channel: str,
+    on_notify: typing.Callable[[str], None],
+    sync: typing.Callable[[bool], typing.Awaitable[typing.Optional[float]]],
+    description: str,
+) -> None:
+    """Keep state in sync with notifications on ``channel`` until cancelled.
+
+    ``on_notify`` is called with payload of every notification and wakes
+    up ``sync``. ``sync`` is called with ``True`` after connecting, when
+    notifications might have been missed, and with ``False`` otherwise.
+    It returns seconds until it has to be called again or ``None`` to
+    wait for notifications. Connection is checked at least every
+    ``LISTEN_CHECK_INTERVAL`` seconds and errors are logged as errors
+    ``description``.
+    """
+    listener = None
+    wakeup_event = asyncio.Event()
+
+    def notify(payload: str) -> None:
+        on_notify(payload)
+        wakeup_event.set()
+
+    while True:
+        wakeup_event.clear()
+        try:
+            connected = listener is None or listener.is_closed()
+            if connected:
+                listener = await listen(channel, notify)
+            timeout = await sync(connected)
+        except Exception as error:
+            logging.getLogger(__name__).error(f"Error {description}: {error}")
+            if listener is not None:
+                listener.terminate()
+            listener = None
+            await asyncio.sleep(LISTEN_ERROR_DELAY)
+            continue
+        if timeout is None or timeout > LISTEN_CHECK_INTERVAL:
+            timeout = LISTEN_CHECK_INTERVAL
+        try:
+            await asyncio.wait_for(wakeup_event.wait(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+
+
+class UpdateState:
+    """FSM state and data of user buffered during processing of update."""
+
+    def __init__(
+        self, user: int, state: typing.Optional[str], data: typing.Dict[str, typing.Any]
+    ):
+        self.user = user
+        self.state = state
+        self.data = copy.deepcopy(data)
+        self.changed = False
+
+
+update_state: contextvars.ContextVar[
+    typing.Optional[UpdateState]
+] = contextvars.ContextVar("update_state", default=None)
 
 
 class PostgreStorage(BaseStorage):
+    """Storage of FSM state and data in users table.
+
+    State and data are cached in process and cache is updated when
+    changes are committed, so they must not be changed in database by
+    anything else. Changes made while processing update of the user are
+    buffered and saved at once when processing is finished.
+    """
+
+    def __init__(self):
+        self.cache: LRUCache[
+            int, typing.Tuple[typing.Optional[str], typing.Dict[str, typing.Any]]
+        ] = LRUCache(config.STORAGE_CACHE_SIZE, config.STORAGE_CACHE_TTL)
+
     async def close(self):
-        pass
+        self.cache.clear()
 
     async def wait_closed(self):
         pass
 
-    async def get_state(self, *, chat=None, user, **kwargs):
-        async with sessionmaker() as session:
-            async with session.begin():
-                cursor = await session.execute(
-                    sa.select(models.User.state).where(models.User.id == user)
+    def cache_on_commit(
+        self,
+        session: sa.ext.asyncio.AsyncSession,
+        user: int,
+        change: typing.Callable[
+            [typing.Optional[str], typing.Dict[str, typing.Any]],
+            typing.Tuple[typing.Optional[str], typing.Dict[str, typing.Any]],
+        ],
+    ) -> None:
+        """Apply ``change`` to cached state and data of ``user`` on commit."""
+        cached = self.cache.pop(user)
+        if cached is not None:
+            state, data = cached
+            on_commit(session, lambda: self.cache.set(user, change(state, data)))
+
+    async def load(
+        self, user: int
+    ) -> typing.Tuple[typing.Optional[str], typing.Dict[str, typing.Any]]:
+        """Get state and data of ``user`` from cache or database."""
+        cached = self.cache.get(user)
+        if cached is not None:
+            return cached
+        async with transaction() as session:
+            cursor = await session.execute(
+                sa.select(models.User.state, models.User.data).where(
+                    models.User.id == user
                 )
-                return cursor.scalar()
+            )
+            row = cursor.one_or_none()
+            if row is None:
+                return None, {}
+            loaded = (row.state, row.data)
+            on_commit(session, lambda: self.cache.set(user, loaded))
+        return loaded
+
+    async def begin_update(self, user: int) -> None:
+        """Start buffering changes of ``user`` in current context."""
+        update_state.set(UpdateState(user, *await self.load(user)))
+
+    async def finish_update(self) -> None:
+        """Save buffered changes of current context."""
+        buffer = update_state.get()
+        if buffer is None:
+            return
+        update_state.set(None)
+        if buffer.changed:
+            await self.save(buffer.user, buffer.state, buffer.data)
+
+    def buffer(self, user: int) -> typing.Optional[UpdateState]:
+        buffer = update_state.get()
+        if buffer is not None and buffer.user == user:
+            return buffer
+        return None
+
+    async def save(
+        self, user: int, state: typing.Optional[str], data: typing.Dict[str, typing.Any]
+    ) -> None:
+        async with transaction() as session:
+            await session.execute(
+                sa.update(models.User)
+                .values(state=state, data=data)
+                .where(models.User.id == user)
+            )
+            self.cache.pop(user)
+            on_commit(session, lambda: self.cache.set(user, (state, data)))
+
+    async def get_state(self, *, chat=None, user, **kwargs):
+        if buffer := self.buffer(user):
+            return buffer.state
+        state, data = await self.load(user)
+        return state
 
     async def get_data(self, *, chat=None, user, **kwargs):
-        async with sessionmaker() as session:
-            async with session.begin():
-                cursor = await session.execute(
-                    sa.select(models.User.data).where(models.User.id == user)
-                )
-                return cursor.scalar()
+        if buffer := self.buffer(user):
+            return copy.deepcopy(buffer.data)
+        state, data = await self.load(user)
+        return copy.deepcopy(data)
 
     async def set_state(self, *, chat=None, user, state=None):
-        async with sessionmaker() as session:
-            async with session.begin():
-                await session.execute(
-                    sa.update(models.User)
-                    .values(state=state)
-                    .where(models.User.id == user)
-                )
+        if buffer := self.buffer(user):
+            buffer.state = state
+            buffer.changed = True
+            return
+        async with transaction() as session:
+            await session.execute(
+                sa.update(models.User).values(state=state).where(models.User.id == user)
+            )
+            self.cache_on_commit(
+                session, user, lambda old_state, old_data: (state, old_data)
+            )
 
     async def set_data(self, *, chat=None, user, data):
-        async with sessionmaker() as session:
-            async with session.begin():
-                await session.execute(
-                    sa.update(models.User)
-                    .values(data=json.dumps(data))
-                    .where(models.User.id == user)
-                )
+        if buffer := self.buffer(user):
+            buffer.data = copy.deepcopy(data)
+            buffer.changed = True
+            return
+        data = copy.deepcopy(data)
+        async with transaction() as session:
+            await session.execute(
+                sa.update(models.User).values(data=data).where(models.User.id == user)
+            )
+            self.cache_on_commit(
+                session, user, lambda old_state, old_data: (old_state, data)
+            )
 
     async def update_data(self, *, chat=None, user, data=None, **kwargs):
         if data is None:
             data = {}
         data.update(kwargs)
-        async with sessionmaker() as session:
-            async with session.begin():
-                await session.execute(
-                    sa.update(models.User)
-                    .values(data=sa.text(f"data || '{json.dumps(data)}'"))
-                    .where(models.User.id == user)
-                )
+        if buffer := self.buffer(user):
+            buffer.data.update(copy.deepcopy(data))
+            buffer.changed = True
+            return
+        data = copy.deepcopy(data)
+        async with transaction() as session:
+            await session.execute(
+                sa.update(models.User)
+                .values(data=models.User.data.op("||")(sa.cast(data, JSONB)))
+                .where(models.User.id == user)
+            )
+            self.cache_on_commit(
+                session,
+                user,
+                lambda old_state, old_data: (old_state, {**old_data, **data}),
+            )
 
     async def reset_state(self, *, chat=None, user, with_data=True):
+        if buffer := self.buffer(user):
+            buffer.state = None
+            if with_data:
+                buffer.data = {}
+            buffer.changed = True
+            return
         values = {"state": None}
         if with_data:
-            values["data"] = sa.text("'{}'")
-        async with sessionmaker() as session:
-            async with session.begin():
-                await session.execute(
-                    sa.update(models.User)
-                    .values(**values)
-                    .where(models.User.id == user)
-                )
+            values["data"] = {}
+        async with transaction() as session:
+            await session.execute(
+                sa.update(models.User).values(**values).where(models.User.id == user)
+            )
+            self.cache_on_commit(
+                session,
+                user,
+                lambda old_state, old_data: (None, {} if with_data else old_data),
+            )
+
+
+class StorageMiddleware(BaseMiddleware):
+    """Buffer changes of FSM state and data during processing of update.
+
+    State and data are loaded before handlers are called and saved with
+    one query after they are finished.
+    """
+
+    async def begin(self) -> None:
+        user = types.User.get_current()
+        if user is not None:
+            await self.manager.dispatcher.storage.begin_update(user.id)
+
+    async def finish(self) -> None:
+        await self.manager.dispatcher.storage.finish_update()
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        await self.begin()
+
+    async def on_post_process_message(
+        self, message: types.Message, results: list, data: dict
+    ):
+        await self.finish()
+
+    async def on_pre_process_callback_query(
+        self, call: types.CallbackQuery, data: dict
+    ):
+        await self.begin()
+
+    async def on_post_process_callback_query(
+        self, call: types.CallbackQuery, results: list, data: dict
+    ):
+        await self.finish()
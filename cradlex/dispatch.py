@@ -0,0 +1,124 @@
+import json
+import typing
+
+import sqlalchemy as sa
+
+from cradlex import database
+from cradlex import geo
+from cradlex import models
+
+
+#: Channel notified by database trigger when workers are changed.
+WORKER_CHANNEL = "worker_changes"
+
+
+def eligible_skills(difficulty: str) -> typing.Tuple[str, ...]:
+    """Get skills of workers who can do task of ``difficulty``.
+
+    Skills form a hierarchy, so worker can do tasks of difficulty up to
+    their skill.
+    """
+    return models.WORKER_SKILL[models.TASK_DIFFICULTY.index(difficulty) :]
+
+
+class WorkerPool:
+    """In-memory sets of registered workers without tasks by skill and
+    index of last known positions of workers.
+
+    Sets are changed by handlers when their changes are committed and by
+    database notifications on changes made by other processes.
+    """
+
+    def __init__(self):
+        self.idle: typing.Dict[str, typing.Set[int]] = {
+            skill: set() for skill in models.WORKER_SKILL
+        }
+        self.positions = geo.GridIndex()
+
+    def set_idle(self, worker_id: int, skill: str) -> None:
+        self.set_busy(worker_id)
+        self.idle[skill].add(worker_id)
+
+    def set_busy(self, worker_id: int) -> None:
+        for workers in self.idle.values():
+            workers.discard(worker_id)
+
+    def set_position(
+        self, worker_id: int, position: typing.Optional[geo.Point]
+    ) -> None:
+        if position is None:
+            self.positions.remove(worker_id)
+        else:
+            self.positions.set(worker_id, position)
+
+    def on_change(self, payload: str) -> None:
+        change = json.loads(payload)
+        if change["id"] is None:
+            return
+        if change["idle"]:
+            self.set_idle(change["id"], change["skill"])
+        else:
+            self.set_busy(change["id"])
+        if change.get("latitude") is None or change.get("longitude") is None:
+            self.set_position(change["id"], None)
+        else:
+            self.set_position(change["id"], (change["latitude"], change["longitude"]))
+
+    async def load(self) -> None:
+        async with database.transaction() as session:
+            idle_cursor = await session.execute(
+                sa.select(models.Worker.id, models.Worker.skill).where(
+                    models.Worker.task_id == None,  # noqa: E711
+                    models.Worker.id != None,  # noqa: E711
+                )
+            )
+            idle_rows = idle_cursor.all()
+            positions_cursor = await session.execute(
+                sa.select(
+                    models.Worker.id, models.Worker.latitude, models.Worker.longitude
+                ).where(
+                    models.Worker.id != None,  # noqa: E711
+                    models.Worker.latitude != None,  # noqa: E711
+                    models.Worker.longitude != None,  # noqa: E711
+                )
+            )
+            positions_rows = positions_cursor.all()
+        idle: typing.Dict[str, typing.Set[int]] = {
+            skill: set() for skill in models.WORKER_SKILL
+        }
+        for worker_id, skill in idle_rows:
+            idle[skill].add(worker_id)
+        positions = geo.GridIndex()
+        for worker_id, latitude, longitude in positions_rows:
+            positions.set(worker_id, (latitude, longitude))
+        self.idle = idle
+        self.positions = positions
+
+    def eligible(self, difficulty: str) -> typing.Set[int]:
+        """Get idle workers who can do task of ``difficulty``."""
+        eligible: typing.Set[int] = set()
+        for skill in eligible_skills(difficulty):
+            eligible |= self.idle[skill]
+        return eligible
+
+    def nearest(
+        self, position: geo.Point, count: int, difficulty: str
+    ) -> typing.List[int]:
+        """Get ``count`` nearest idle workers able to do task of ``difficulty``."""
+        return self.positions.nearest(position, count, self.eligible(difficulty))
+
+    async def sync(self, reconnected: bool) -> None:
+        if reconnected:
+            await self.load()
+
+    async def run(self) -> None:
+        """Apply database notifications until cancelled.
+
+        Sets are reloaded whenever notifications might have been missed.
+        """
+        await database.follow(
+            WORKER_CHANNEL, self.on_change, self.sync, "loading workers"
+        )
+
+
+workers = WorkerPool()
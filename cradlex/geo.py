@@ -0,0 +1,156 @@
+import collections
+import heapq
+import itertools
+import json
+import math
+import typing
+
+from cradlex import config
+
+
+#: Mean radius of the Earth in kilometers.
+EARTH_RADIUS = 6371.0
+#: Kilometers in a degree of latitude.
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+#: Size of cells of ``GridIndex`` in degrees, about 5 km of latitude.
+CELL_SIZE = 0.05
+
+Point = typing.Tuple[float, float]
+
+
+def distance(first: Point, second: Point) -> float:
+    """Get great-circle distance between points in kilometers."""
+    latitude1, longitude1 = map(math.radians, first)
+    latitude2, longitude2 = map(math.radians, second)
+    haversine = (
+        math.sin((latitude2 - latitude1) / 2) ** 2
+        + math.cos(latitude1)
+        * math.cos(latitude2)
+        * math.sin((longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(haversine)))
+
+
+class GridIndex:
+    """In-memory index of points in cells of a latitude and longitude grid.
+
+    Nearest points are searched in rings of cells around given point
+    until no closer points can be found further.
+    """
+
+    def __init__(self, cell_size: float = CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells: typing.DefaultDict[
+            typing.Tuple[int, int], typing.Set[int]
+        ] = collections.defaultdict(set)
+        self.points: typing.Dict[int, Point] = {}
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def cell(self, point: Point) -> typing.Tuple[int, int]:
+        return (
+            math.floor(point[0] / self.cell_size),
+            math.floor(point[1] / self.cell_size),
+        )
+
+    def set(self, key: int, point: Point) -> None:
+        self.remove(key)
+        self.points[key] = point
+        self.cells[self.cell(point)].add(key)
+
+    def remove(self, key: int) -> None:
+        point = self.points.pop(key, None)
+        if point is None:
+            return
+        cell = self.cell(point)
+        self.cells[cell].discard(key)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def ring(
+        self, center: typing.Tuple[int, int], radius: int
+    ) -> typing.Iterator[typing.Tuple[int, int]]:
+        """Iterate over cells at ``radius`` cells from ``center``."""
+        row, column = center
+        if radius == 0:
+            yield center
+            return
+        for offset in range(-radius, radius + 1):
+            yield row - radius, column + offset
+            yield row + radius, column + offset
+        for offset in range(-radius + 1, radius):
+            yield row + offset, column - radius
+            yield row + offset, column + radius
+
+    def nearest(
+        self,
+        point: Point,
+        count: int,
+        keys: typing.Optional[typing.AbstractSet[int]] = None,
+    ) -> typing.List[int]:
+        """Get at most ``count`` keys nearest to ``point`` sorted by distance.
+
+        If ``keys`` is set, only these keys are searched. Distances are
+        compared in equirectangular projection, which is accurate enough
+        for distances within a city.
+        """
+        if not self.cells or count <= 0:
+            return []
+        scale = math.cos(math.radians(min(abs(point[0]), 89.0)))
+
+        def squared_distance(key: int) -> float:
+            latitude, longitude = self.points[key]
+            return (latitude - point[0]) ** 2 + ((longitude - point[1]) * scale) ** 2
+
+        center = self.cell(point)
+        found: typing.List[typing.Tuple[float, int]] = []
+        for radius in itertools.count():
+            if (2 * radius + 1) ** 2 > len(self.points):
+                # More cells are scanned than there are points in the
+                # index, so scanning all points is cheaper.
+                found = [
+                    (squared_distance(key), key)
+                    for key in self.points
+                    if keys is None or key in keys
+                ]
+                break
+            for cell in self.ring(center, radius):
+                for key in self.cells.get(cell, ()):
+                    if keys is None or key in keys:
+                        found.append((squared_distance(key), key))
+            if len(found) >= count:
+                farthest = heapq.nsmallest(count, found)[-1][0]
+                if farthest <= (radius * self.cell_size * scale) ** 2:
+                    break
+        return [key for _distance, key in heapq.nsmallest(count, found)]
+
+
+def normalize_place(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+def load_gazetteer() -> typing.Dict[str, Point]:
+    """Load coordinates of places from ``GAZETTEER_FILENAME`` if it is set.
+
+    File contains JSON object mapping names of places to lists of
+    latitude and longitude.
+    """
+    try:
+        filename = config.GAZETTEER_FILENAME
+    except AttributeError:
+        return {}
+    with open(filename, "r") as gazetteer_file:
+        places = json.load(gazetteer_file)
+    return {
+        normalize_place(name): (latitude, longitude)
+        for name, (latitude, longitude) in places.items()
+    }
+
+
+gazetteer = load_gazetteer()
+
+
+def geocode(place: str) -> typing.Optional[Point]:
+    """Get coordinates of ``place`` from gazetteer."""
+    return gazetteer.get(normalize_place(place))
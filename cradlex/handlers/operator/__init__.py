@@ -1,3 +1,5 @@
+from cradlex.handlers.operator import stats
+from cradlex.handlers.operator import task_cancellation
 from cradlex.handlers.operator import task_creation
 from cradlex.handlers.operator import task_review
 from cradlex.handlers.operator import task_type_management
@@ -0,0 +1,16 @@
+from aiogram import types
+from aiogram.dispatcher.filters.state import any_state
+
+from cradlex import metrics
+from cradlex.bot import dp
+from cradlex.filters import OperatorFilter
+from cradlex.i18n import _
+
+
+@dp.message_handler(OperatorFilter(), commands=["stats"], state=any_state)
+async def show_stats(message: types.Message):
+    stats = metrics.snapshot()
+    if not stats:
+        return await message.answer(_("no_stats"))
+    lines = (f"{name}: {value}" for name, value in stats.items())
+    await message.answer(_("stats") + "\n" + "\n".join(lines))
@@ -0,0 +1,88 @@
+import typing
+
+import sqlalchemy as sa
+from aiogram import types
+from aiogram.dispatcher.filters.state import any_state
+from aiogram.utils.parts import MAX_MESSAGE_LENGTH
+
+from cradlex import callback_data
+from cradlex import database
+from cradlex import models
+from cradlex import utils
+from cradlex.bot import dp
+from cradlex.filters import OperatorFilter
+from cradlex.i18n import _
+
+
+#: Maximum number of the earliest untaken tasks offered for cancellation.
+CANCEL_LIST_SIZE = 10
+
+
+@dp.message_handler(OperatorFilter(), commands=["cancel_task"], state=any_state)
+async def list_tasks_to_cancel(message: types.Message):
+    async with database.readonly() as session:
+        cursor = await session.execute(
+            sa.select(models.Task)
+            .where(
+                models.Task.worker_id == None,  # noqa: E711
+                models.Task.time > sa.func.current_timestamp(),
+                sa.not_(models.Task.cancelled),
+            )
+            .order_by(models.Task.time)
+            .limit(CANCEL_LIST_SIZE)
+        )
+        tasks = cursor.scalars().all()
+    if not tasks:
+        return await message.answer(_("no_tasks_to_cancel"))
+    # All tasks are listed in one message so that the operator's chat
+    # isn't flooded. Long cards are shortened to fit into it.
+    keyboard_markup = types.InlineKeyboardMarkup(row_width=1)
+    texts = [_("ask_task_to_cancel")]
+    # Every card is preceded by an empty line and its number.
+    prefix_length = len(f"\n\n{len(tasks)}. ")
+    card_length = (MAX_MESSAGE_LENGTH - len(texts[0])) // len(tasks) - prefix_length
+    for number, task in enumerate(tasks, start=1):
+        card = utils.shorten(await utils.task_message(task), card_length)
+        texts.append(f"{number}. {card}")
+        keyboard_markup.add(
+            types.InlineKeyboardButton(
+                f"{number}. " + _("cancel_task"),
+                callback_data=callback_data.cancel_task.new(task_id=task.id),
+            )
+        )
+    await message.answer("\n\n".join(texts), reply_markup=keyboard_markup)
+
+
+@dp.callback_query_handler(OperatorFilter(), callback_data.cancel_task.filter())
+async def cancel_task(
+    call: types.CallbackQuery, callback_data: typing.Mapping[str, str]
+):
+    async with database.transaction() as session:
+        task_id = await session.scalar(
+            sa.update(models.Task)
+            .values(cancelled=True, next_wave_at=None)
+            .where(
+                models.Task.id == callback_data["task_id"],
+                models.Task.worker_id == None,  # noqa: E711
+                sa.not_(models.Task.cancelled),
+            )
+            .returning(models.Task.id)
+            .execution_options(synchronize_session=False)
+        )
+        if task_id is not None:
+            await utils.retract_offers(session, [task_id])
+    if task_id is None:
+        await call.answer(_("task_cancel_error"), show_alert=True)
+    else:
+        await call.answer(_("task_cancelled"))
+    rows = [
+        row
+        for row in call.message.reply_markup.inline_keyboard
+        if row[0].callback_data != call.data
+    ]
+    if rows:
+        await call.message.edit_reply_markup(
+            types.InlineKeyboardMarkup(inline_keyboard=rows)
+        )
+    else:
+        await call.message.delete_reply_markup()
@@ -1,10 +1,8 @@
-import asyncio
 import datetime
 import re
 import typing
 
 import pytz
-import sqlalchemy as sa
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import any_state
@@ -12,11 +10,14 @@ from aiogram.dispatcher.filters.state import State
 
 from cradlex import callback_data
 from cradlex import database
+from cradlex import geo
 from cradlex import models
 from cradlex import utils
 from cradlex.bot import dp
+from cradlex.catalog import catalog
 from cradlex.filters import OperatorFilter
 from cradlex.i18n import _
+from cradlex.markup import markups
 from cradlex.states import TaskCreation
 
 
@@ -33,8 +34,7 @@ def step_handler(state: State):
 
 @dp.message_handler(OperatorFilter(), commands=["create_task"], state=any_state)
 async def create_task(message: types.Message, state: FSMContext):
-    keyboard_markup = await utils.get_task_types_keyboard()
-    if not keyboard_markup.keyboard:
+    if not catalog.task_types:
         return await message.answer(_("no_task_types"))
     await TaskCreation.payment.set()
     await message.answer(_("ask_task_payment"))
@@ -63,11 +63,23 @@ async def set_task_payment(message: types.Message, state: FSMContext):
 
 @step_handler(TaskCreation.location)
 async def location_step(message: types.Message, state: FSMContext) -> bool:
-    await state.update_data(location=message.text)
+    latitude: typing.Optional[float]
+    longitude: typing.Optional[float]
+    if message.location:
+        latitude = message.location.latitude
+        longitude = message.location.longitude
+        location = f"{latitude:.5f}, {longitude:.5f}"
+    else:
+        location = message.text
+        latitude, longitude = geo.geocode(location) or (None, None)
+    await state.update_data(location=location, latitude=latitude, longitude=longitude)
     return True
 
 
-@dp.message_handler(state=TaskCreation.location)
+@dp.message_handler(
+    content_types=[types.ContentType.TEXT, types.ContentType.LOCATION],
+    state=TaskCreation.location,
+)
 async def set_task_location(message: types.Message, state: FSMContext):
     if await location_step(message, state):
         await TaskCreation.time.set()
@@ -156,12 +168,11 @@ async def comment_step(message: types.Message, state: FSMContext) -> bool:
 async def set_task_comment(message: types.Message, state: FSMContext):
     if not await comment_step(message, state):
         return
-    keyboard_markup = await utils.get_task_types_keyboard()
-    if not keyboard_markup.keyboard:
+    if not catalog.task_types:
         await state.finish()
         return await message.answer(_("no_task_types"))
     await TaskCreation.task_type.set()
-    await message.answer(_("ask_task_type"), reply_markup=keyboard_markup)
+    await message.answer(_("ask_task_type"), reply_markup=markups.get("task_types"))
 
 
 @step_handler(TaskCreation.task_type)
@@ -171,19 +182,10 @@ async def task_type_step(message: types.Message, state: FSMContext) -> bool:
         await message.answer(_("task_type_invalid_error"))
         return False
     name, difficulty = task_type_result
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            task_type_cursor = await session.execute(
-                sa.select(models.TaskType).where(
-                    models.TaskType.name == name,
-                    models.TaskType.difficulty == difficulty,
-                )
-            )
-        try:
-            task_type = task_type_cursor.one()[0]
-        except sa.exc.NoResultFound:
-            await message.answer(_("task_type_not_found_error"))
-            return False
+    task_type = catalog.find(name, difficulty)
+    if task_type is None:
+        await message.answer(_("task_type_not_found_error"))
+        return False
     await state.update_data(type_id=task_type.id)
     return True
 
@@ -279,6 +281,16 @@ async def edit_task_step(
     await call.message.edit_text(answer)
 
 
+@dp.message_handler(
+    content_types=types.ContentType.LOCATION, state=TaskCreation.edit_task
+)
+async def edit_task_location(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    if data.get("edit_step") == TaskCreation.location._state:
+        await location_step(message, state)
+        await check_task(message, state)
+
+
 @dp.message_handler(state=TaskCreation.edit_task)
 async def edit_task_finish(message: types.Message, state: FSMContext):
     data = await state.get_data()
@@ -294,16 +306,18 @@ async def broadcast_task(call: types.CallbackQuery, state: FSMContext):
     async with state.proxy() as data:
         task = models.Task(
             location=data["location"],
+            latitude=data.get("latitude"),
+            longitude=data.get("longitude"),
             time=datetime.datetime.fromisoformat(data["time"]),
             contact=data["contact"],
             comment=data["comment"],
             type_id=data["type_id"],
             payment=data["payment"],
         )
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            session.add(task)
-    asyncio.create_task(utils.broadcast_task(task.id))
+    async with database.transaction() as session:
+        session.add(task)
+        await session.flush()
+        await utils.broadcast_task(session, task)
     await state.finish()
     await call.answer()
     await call.message.answer(_("task_broadcasted"))
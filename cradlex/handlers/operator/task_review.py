@@ -1,3 +1,4 @@
+import functools
 import typing
 
 import sqlalchemy as sa
@@ -6,10 +7,11 @@ from aiogram import types
 from cradlex import callback_data
 from cradlex import database
 from cradlex import models
+from cradlex import outbox
 from cradlex import states
 from cradlex import utils
-from cradlex.bot import bot
 from cradlex.bot import dp
+from cradlex.dispatch import workers
 from cradlex.filters import OperatorFilter
 from cradlex.i18n import _
 
@@ -18,14 +20,13 @@ from cradlex.i18n import _
 async def review_task(
     call: types.CallbackQuery, callback_data: typing.Mapping[str, str]
 ):
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            worker_cursor = await session.execute(
-                sa.select(models.Worker)
-                .join(models.Task, onclause=models.Worker.id == models.Task.worker_id)
-                .where(models.Task.id == callback_data["task_id"])
-            )
-            worker = worker_cursor.one()[0]
+    async with database.readonly() as session:
+        worker_cursor = await session.execute(
+            sa.select(models.Worker)
+            .join(models.Task, onclause=models.Worker.id == models.Task.worker_id)
+            .where(models.Task.id == callback_data["task_id"])
+        )
+        worker = worker_cursor.one()[0]
     await call.answer()
     review = callback_data["review"]
     redo = True
@@ -44,4 +45,22 @@ async def review_task(
     if redo:
         await dp.storage.set_state(user=worker.id, state=states.task_photo.state)
     await call.message.answer(operator_answer)
-    await bot.send_message(worker.id, worker_answer)
+    async with database.transaction() as session:
+        if not redo:
+            released_worker_id = await session.scalar(
+                sa.update(models.Worker)
+                .values(task_id=None)
+                .where(
+                    models.Worker.id == worker.id,
+                    models.Worker.task_id == callback_data["task_id"],
+                )
+                .returning(models.Worker.id)
+            )
+            if released_worker_id is not None:
+                database.on_commit(
+                    session,
+                    functools.partial(workers.set_idle, worker.id, worker.skill),
+                )
+        await outbox.enqueue(
+            session, outbox.message(worker.id, "send_message", text=worker_answer)
+        )
@@ -1,3 +1,5 @@
+import functools
+
 import sqlalchemy as sa
 from aiogram import types
 from aiogram.dispatcher import FSMContext
@@ -8,8 +10,10 @@ from cradlex import database
 from cradlex import models
 from cradlex import utils
 from cradlex.bot import dp
+from cradlex.catalog import catalog
 from cradlex.filters import OperatorFilter
 from cradlex.i18n import _
+from cradlex.markup import markups
 from cradlex.states import type_deletion
 from cradlex.states import TypeCreation
 
@@ -20,17 +24,24 @@ async def start_type_creation(message: types.Message, state: FSMContext):
     await message.answer(_("ask_type_to_create"))
 
 
-@dp.message_handler(state=TypeCreation.name)
-async def set_type_name(message: types.Message, state: FSMContext):
+@markups.builder("type_difficulty")
+def difficulty_keyboard() -> types.ReplyKeyboardMarkup:
     star = emojize(":star:")
     diffs = len(models.TASK_DIFFICULTY) + 1
     keyboard_markup = types.ReplyKeyboardMarkup(
         row_width=diffs, one_time_keyboard=True, resize_keyboard=True
     )
     keyboard_markup.add(*(star * i for i in range(diffs)))
+    return keyboard_markup
+
+
+@dp.message_handler(state=TypeCreation.name)
+async def set_type_name(message: types.Message, state: FSMContext):
     await state.update_data(name=message.text.lower().capitalize())
     await TypeCreation.difficulty.set()
-    await message.answer(_("ask_type_difficulty"), reply_markup=keyboard_markup)
+    await message.answer(
+        _("ask_type_difficulty"), reply_markup=markups.get("type_difficulty")
+    )
 
 
 @dp.message_handler(state=TypeCreation.difficulty)
@@ -41,9 +52,10 @@ async def set_type_difficulty(message: types.Message, state: FSMContext):
     difficulty = models.TASK_DIFFICULTY[difficulty_index - 1]
     async with state.proxy() as data:
         task_type = models.TaskType(name=data["name"], difficulty=difficulty)
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            session.add(task_type)
+    async with database.transaction() as session:
+        session.add(task_type)
+        await session.flush()
+        database.on_commit(session, functools.partial(catalog.add, task_type))
     await state.finish()
     await message.answer(
         _("task_type_created"), reply_markup=types.ReplyKeyboardRemove()
@@ -52,11 +64,12 @@ async def set_type_difficulty(message: types.Message, state: FSMContext):
 
 @dp.message_handler(commands=["delete_type"], state=any_state)
 async def start_type_deletion(message: types.Message, state: FSMContext):
-    keyboard_markup = await utils.get_task_types_keyboard()
-    if not keyboard_markup.keyboard:
+    if not catalog.task_types:
         return await message.answer(_("no_types_to_delete"))
     await type_deletion.set()
-    await message.answer(_("ask_type_to_delete"), reply_markup=keyboard_markup)
+    await message.answer(
+        _("ask_type_to_delete"), reply_markup=markups.get("task_types")
+    )
 
 
 @dp.message_handler(state=type_deletion)
@@ -66,20 +79,20 @@ async def finish_type_deletion(message: types.Message, state: FSMContext):
         await message.answer(_("task_type_invalid_error"))
         return False
     name, difficulty = task_type_result
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            task_type_cursor = await session.execute(
-                sa.delete(models.TaskType)
-                .where(
-                    models.TaskType.name == name,
-                    models.TaskType.difficulty == difficulty,
-                )
-                .returning(models.TaskType.id)
+    async with database.transaction() as session:
+        task_type_cursor = await session.execute(
+            sa.delete(models.TaskType)
+            .where(
+                models.TaskType.name == name,
+                models.TaskType.difficulty == difficulty,
             )
+            .returning(models.TaskType.id)
+        )
         try:
-            task_type_cursor.one()
+            task_type_id = task_type_cursor.scalar_one()
         except sa.exc.NoResultFound:
             return await message.answer(_("task_type_not_found_error"))
+        database.on_commit(session, functools.partial(catalog.remove, task_type_id))
     await state.finish()
     await message.answer(
         _("task_type_deleted"), reply_markup=types.ReplyKeyboardRemove()
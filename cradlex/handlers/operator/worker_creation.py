@@ -13,6 +13,7 @@ from cradlex import utils
 from cradlex.bot import dp
 from cradlex.filters import OperatorFilter
 from cradlex.i18n import _
+from cradlex.markup import markups
 from cradlex.states import WorkerCreation
 
 
@@ -59,6 +60,7 @@ async def phone_step(message: types.Message, state: FSMContext) -> bool:
     return True
 
 
+@markups.builder("skill")
 def skill_keyboard() -> types.ReplyKeyboardMarkup:
     buttons = utils.skill_levels()
     keyboard_markup = types.ReplyKeyboardMarkup(
@@ -73,7 +75,7 @@ async def set_worker_phone(message: types.Message, state: FSMContext):
     if not await phone_step(message, state):
         return
     await WorkerCreation.skill.set()
-    await message.answer(_("ask_worker_skill"), reply_markup=skill_keyboard())
+    await message.answer(_("ask_worker_skill"), reply_markup=markups.get("skill"))
 
 
 @step_handler(WorkerCreation.skill)
@@ -166,7 +168,7 @@ async def edit_worker_step(
         answer = _("ask_new_phone")
     elif step == WorkerCreation.skill._state:
         answer = _("ask_new_skill")
-        reply_keyboard = skill_keyboard()
+        reply_keyboard = markups.get("skill")
     else:
         await call.answer(_("unknown_step"))
         return await check_worker(call, state)
@@ -197,9 +199,8 @@ async def save_worker(call: types.CallbackQuery, state: FSMContext):
             phone=data["phone"],
             skill=data["skill"],
         )
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            session.add(worker)
+    async with database.transaction() as session:
+        session.add(worker)
     await state.finish()
     await call.answer()
     await call.message.answer(_("worker_saved"))
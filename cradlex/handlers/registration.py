@@ -1,3 +1,5 @@
+import functools
+
 import phonenumbers
 import sqlalchemy as sa
 from aiogram import types
@@ -8,6 +10,7 @@ from cradlex import database
 from cradlex import models
 from cradlex import states
 from cradlex.bot import dp
+from cradlex.dispatch import workers
 from cradlex.filters import OperatorFilter
 from cradlex.i18n import _
 
@@ -27,20 +30,24 @@ async def first_message(message: types.Message, state: FSMContext):
 async def set_phone(
     phone: phonenumbers.PhoneNumber, message: types.Message, state: FSMContext
 ):
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            worker_cursor = await session.execute(
-                sa.update(models.Worker)
-                .where(
-                    models.Worker.phone
-                    == phonenumbers.format_number(
-                        phone, phonenumbers.PhoneNumberFormat.E164
-                    ),
-                )
-                .values(id=message.from_user.id)
-                .returning(models.Worker.name)
+    async with database.transaction() as session:
+        worker_cursor = await session.execute(
+            sa.update(models.Worker)
+            .where(
+                models.Worker.phone
+                == phonenumbers.format_number(
+                    phone, phonenumbers.PhoneNumberFormat.E164
+                ),
+            )
+            .values(id=message.from_user.id)
+            .returning(models.Worker.name, models.Worker.skill, models.Worker.task_id)
+        )
+        worker = worker_cursor.one_or_none()
+        if worker is not None and worker.task_id is None:
+            database.on_commit(
+                session,
+                functools.partial(workers.set_idle, message.from_user.id, worker.skill),
             )
-            worker = worker_cursor.one_or_none()
     if worker is None:
         await message.answer(_("worker_not_found"))
     else:
@@ -1,66 +1,146 @@
-import asyncio
+import functools
 import typing
 
 import sqlalchemy as sa
 from aiogram import types
 from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import any_state
+from sqlalchemy.sql.selectable import ScalarSelect
 
 from cradlex import callback_data
 from cradlex import config
 from cradlex import database
+from cradlex import geo
 from cradlex import models
 from cradlex import utils
 from cradlex.bot import bot
 from cradlex.bot import dp
+from cradlex.dispatch import workers
 from cradlex.i18n import _
+from cradlex.markup import markups
 from cradlex.states import task_photo
 
 
-@dp.callback_query_handler(callback_data.take_task.filter())
-async def take_task(
-    call: types.CallbackQuery,
-    callback_data: typing.Mapping[str, str],
-):
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            vacant = models.Task.worker_id == None  # noqa: E711
-            unexpired = models.Task.time > sa.func.current_timestamp()
+#: Kilometers a worker must move for the new location to be saved.
+POSITION_ACCURACY = 0.05
+
+
+def current_task_id(worker_id: int) -> ScalarSelect:
+    """Get subquery of ID of task currently taken by worker."""
+    return (
+        sa.select(models.Worker.task_id)
+        .where(models.Worker.id == worker_id)
+        .scalar_subquery()
+    )
+
+
+async def claim_task(worker_id: int, task_id: str) -> typing.Optional[str]:
+    """Assign task ``task_id`` to idle worker ``worker_id``.
+
+    Other offers of the task are retracted. Return ``None`` if the task
+    is claimed or the reason why it isn't otherwise: ``"worker_busy"``,
+    ``"not_exists"``, ``"already_taken"``, ``"cancelled"`` or
+    ``"expired"``.
+    """
+    async with database.transaction() as session:
+        # Lock the worker so that they can't take several tasks at once.
+        idle_worker_id = await session.scalar(
+            sa.select(models.Worker.id)
+            .where(
+                models.Worker.id == worker_id,
+                models.Worker.task_id == None,  # noqa: E711
+            )
+            .with_for_update()
+        )
+        if idle_worker_id is None:
+            return "worker_busy"
+        claimed_task_id = await session.scalar(
+            sa.update(models.Task)
+            .values(worker_id=worker_id)
+            .where(
+                models.Task.id == task_id,
+                models.Task.worker_id == None,  # noqa: E711
+                models.Task.time > sa.func.current_timestamp(),
+                sa.not_(models.Task.cancelled),
+            )
+            .returning(models.Task.id)
+            .execution_options(synchronize_session=False)
+        )
+        if claimed_task_id is None:
             task_properties_cursor = await session.execute(
                 sa.select(
-                    vacant.label("vacant"), unexpired.label("unexpired")  # type: ignore
-                )
-                .where(models.Task.id == callback_data["task_id"])
-                .execution_options(synchronize_session=False)
+                    (models.Task.worker_id == None).label("vacant"),  # noqa: E711
+                    (models.Task.time > sa.func.current_timestamp()).label("unexpired"),
+                    models.Task.cancelled,
+                ).where(models.Task.id == task_id)
             )
             task_properties = task_properties_cursor.one_or_none()
             if not task_properties:
-                error = _("task_not_exists_error")
+                return "not_exists"
             elif not task_properties.vacant:
-                error = _("task_already_taken_error")
-            elif not task_properties.unexpired:
-                error = _("task_expired_error")
-            else:
-                await session.execute(
-                    sa.update(models.Task)
-                    .values(worker_id=call.from_user.id)
-                    .where(models.Task.id == callback_data["task_id"])
-                )
-                await call.answer(_("task_taken"), show_alert=True)
-                await call.message.delete_reply_markup()
-                messages_to_delete = await session.execute(
-                    sa.delete(models.TaskMessage)
-                    .where(
-                        models.TaskMessage.task_id == callback_data["task_id"],
-                        models.TaskMessage.worker_id != call.from_user.id,
-                    )
-                    .returning(models.TaskMessage.worker_id, models.TaskMessage.id)
-                )
-                asyncio.create_task(
-                    utils.delete_task_messages(messages_to_delete.all())
-                )
-                return
-        await call.answer(error, show_alert=True)
-        await call.message.delete()
+                return "already_taken"
+            elif task_properties.cancelled:
+                return "cancelled"
+            return "expired"
+        await session.execute(
+            sa.update(models.Worker)
+            .values(task_id=task_id)
+            .where(models.Worker.id == worker_id)
+        )
+        await session.execute(
+            sa.delete(models.OutboxMessage).where(
+                models.OutboxMessage.task_id == task_id,
+                models.OutboxMessage.method == "send_message",
+            )
+        )
+        await session.execute(
+            sa.delete(models.TaskOffer).where(models.TaskOffer.task_id == task_id)
+        )
+        # Offer taken by the worker is deleted from task_messages too,
+        # but its message is kept.
+        messages_cursor = await session.execute(
+            sa.delete(models.TaskMessage)
+            .where(models.TaskMessage.task_id == task_id)
+            .returning(
+                models.TaskMessage.worker_id,
+                models.TaskMessage.id,
+                models.TaskMessage.task_id,
+            )
+        )
+        await utils.delete_task_messages(
+            session,
+            [row for row in messages_cursor.all() if row.worker_id != worker_id],
+        )
+        database.on_commit(session, functools.partial(workers.set_busy, worker_id))
+        # Release lock of the task before calling bot API so that other
+        # workers taking it are answered without waiting.
+        await session.commit()
+    return None
+
+
+@dp.callback_query_handler(callback_data.take_task.filter())
+async def take_task(
+    call: types.CallbackQuery,
+    callback_data: typing.Mapping[str, str],
+):
+    error = await claim_task(call.from_user.id, callback_data["task_id"])
+    if error is None:
+        await call.answer(_("task_taken"), show_alert=True)
+        await call.message.delete_reply_markup()
+        return
+    if error == "worker_busy":
+        # Offer is still valid for the worker after their current task
+        # is done.
+        return await call.answer(_("worker_busy_error"), show_alert=True)
+    if error == "not_exists":
+        await call.answer(_("task_not_exists_error"), show_alert=True)
+    elif error == "already_taken":
+        await call.answer(_("task_already_taken_error"), show_alert=True)
+    elif error == "cancelled":
+        await call.answer(_("task_cancelled_error"), show_alert=True)
+    else:
+        await call.answer(_("task_expired_error"), show_alert=True)
+    await call.message.delete()
 
 
 @dp.message_handler(
@@ -70,13 +150,12 @@ async def verify_task(message: types.Message, state: FSMContext):
     for timeliness, clock in models.TASK_TIMELINESS.items():
         if clock and message.text.startswith(clock):
             break
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            await session.execute(
-                sa.update(models.Task)
-                .values(timeliness=timeliness)
-                .where(models.Task.worker_id == message.from_user.id)
-            )
+    async with database.transaction() as session:
+        await session.execute(
+            sa.update(models.Task)
+            .values(timeliness=timeliness)
+            .where(models.Task.id == current_task_id(message.from_user.id))
+        )
     await message.answer(_("task_verified"))
 
 
@@ -87,15 +166,8 @@ async def task_done(call: types.CallbackQuery):
     await call.message.answer(_("make_photo"))
 
 
-@dp.message_handler(content_types=types.ContentType.PHOTO, state=task_photo)
-async def send_photo(message: types.Message, state: FSMContext):
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            task_id = await session.scalar(
-                sa.select(models.Task.id).where(
-                    models.Task.worker_id == message.from_user.id
-                )
-            )
+@markups.builder("review_task")
+def review_keyboard(task_id: str) -> types.InlineKeyboardMarkup:
     keyboard_markup = types.InlineKeyboardMarkup(row_width=1)
     keyboard_markup.add(
         types.InlineKeyboardButton(
@@ -117,9 +189,58 @@ async def send_photo(message: types.Message, state: FSMContext):
             ),
         ),
     )
+    return keyboard_markup
+
+
+@dp.message_handler(content_types=types.ContentType.PHOTO, state=task_photo)
+async def send_photo(message: types.Message, state: FSMContext):
+    async with database.transaction() as session:
+        task_id = await session.scalar(sa.select(current_task_id(message.from_user.id)))
+    if task_id is None:
+        await state.finish()
+        return await message.answer(_("no_current_task_error"))
     await message.forward(chat_id=config.OPERATOR_ID)
     await bot.send_message(
-        config.OPERATOR_ID, _("review_job"), reply_markup=keyboard_markup
+        config.OPERATOR_ID,
+        _("review_job"),
+        reply_markup=markups.get("review_task", task_id=task_id),
     )
     await message.answer(_("photo_forwarded"))
     await state.finish()
+
+
+async def save_location(message: types.Message) -> bool:
+    """Save location of worker from ``message``.
+
+    Return ``False`` if sender is not a worker.
+    """
+    position = (message.location.latitude, message.location.longitude)
+    last_position = workers.positions.points.get(message.from_user.id)
+    if (
+        last_position is not None
+        and geo.distance(last_position, position) < POSITION_ACCURACY
+    ):
+        return True
+    async with database.transaction() as session:
+        worker_id = await session.scalar(
+            sa.update(models.Worker)
+            .values(latitude=position[0], longitude=position[1])
+            .where(models.Worker.id == message.from_user.id)
+            .returning(models.Worker.id)
+        )
+        if worker_id is not None:
+            database.on_commit(
+                session, functools.partial(workers.set_position, worker_id, position)
+            )
+    return worker_id is not None
+
+
+@dp.message_handler(content_types=types.ContentType.LOCATION, state=any_state)
+async def set_location(message: types.Message):
+    if await save_location(message) and not message.location.live_period:
+        await message.answer(_("location_saved"))
+
+
+@dp.edited_message_handler(content_types=types.ContentType.LOCATION, state=any_state)
+async def update_live_location(message: types.Message):
+    await save_location(message)
@@ -1,6 +1,32 @@
+import contextlib
+import typing
 from pathlib import Path
 
 from aiogram.contrib.middlewares.i18n import I18nMiddleware
 
 
 _ = i18n = I18nMiddleware("cradlex", Path(__file__).parents[1] / "locales", "ru")
+
+
+def user_locale(language_code: typing.Optional[str]) -> str:
+    """Get locale of messages for user with ``language_code``."""
+    if language_code is not None:
+        language = language_code.split("-")[0]
+        if language in i18n.locales:
+            return language
+    return i18n.default
+
+
+def current_locale() -> str:
+    """Get locale of user whose update is processed."""
+    return i18n.ctx_locale.get() or i18n.default
+
+
+@contextlib.contextmanager
+def use_locale(locale: str) -> typing.Iterator[None]:
+    """Translate messages to ``locale`` in the block."""
+    token = i18n.ctx_locale.set(locale)
+    try:
+        yield
+    finally:
+        i18n.ctx_locale.reset(token)
@@ -0,0 +1,73 @@
+import json
+import typing
+
+from aiogram import types
+
+from cradlex.catalog import catalog
+from cradlex.i18n import current_locale
+from cradlex.i18n import use_locale
+
+
+Markup = typing.Union[
+    types.InlineKeyboardMarkup, types.ReplyKeyboardMarkup, types.ReplyKeyboardRemove
+]
+
+
+class MarkupCache:
+    """Cache of reply markups serialized to JSON.
+
+    Markups are built by functions registered with ``builder`` once per
+    locale and version of task type catalog. Serialized markups can be
+    passed as ``reply_markup`` to bot API methods and outbox messages.
+    """
+
+    def __init__(self):
+        self.builders: typing.Dict[str, typing.Callable[..., Markup]] = {}
+        self.markups: typing.Dict[typing.Tuple[str, str], str] = {}
+        self.version = catalog.version
+
+    def builder(
+        self, kind: str
+    ) -> typing.Callable[[typing.Callable[..., Markup]], typing.Callable[..., Markup]]:
+        """Register function building markups of ``kind``.
+
+        Keyword arguments of the function are filled with placeholders
+        replaced with actual values when markup is taken from cache.
+        """
+
+        def decorator(
+            callback: typing.Callable[..., Markup]
+        ) -> typing.Callable[..., Markup]:
+            self.builders[kind] = callback
+            return callback
+
+        return decorator
+
+    def get(self, kind: str, locale: typing.Optional[str] = None, **params: str) -> str:
+        """Get serialized markup of ``kind`` with ``params``.
+
+        Markup is localized to ``locale`` or locale of current user.
+        """
+        if locale is None:
+            locale = current_locale()
+        if self.version != catalog.version:
+            self.markups.clear()
+            self.version = catalog.version
+        markup = self.markups.get((kind, locale))
+        if markup is None:
+            with use_locale(locale):
+                built = self.builders[kind](
+                    **{name: self.placeholder(name) for name in params}
+                )
+            markup = json.dumps(built.to_python(), ensure_ascii=False)
+            self.markups[(kind, locale)] = markup
+        for name, value in params.items():
+            markup = markup.replace(self.placeholder(name), json.dumps(value)[1:-1])
+        return markup
+
+    @staticmethod
+    def placeholder(name: str) -> str:
+        return f"{{{name}}}"
+
+
+markups = MarkupCache()
@@ -0,0 +1,21 @@
+import collections
+import typing
+
+
+counters: typing.Counter[str] = collections.Counter()
+gauges: typing.Dict[str, float] = {}
+
+
+def increment(name: str, value: int = 1) -> None:
+    counters[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    gauges[name] = value
+
+
+def snapshot() -> typing.Dict[str, float]:
+    """Get current values of all metrics sorted by name."""
+    values: typing.Dict[str, float] = {**counters}
+    values.update(gauges)
+    return dict(sorted(values.items()))
@@ -30,6 +30,7 @@ class User(Base):
     first_name: str = sa.Column(sa.Text, nullable=False)
     last_name: str = sa.Column(sa.Text)
     username: str = sa.Column(sa.Text)
+    language_code: str = sa.Column(sa.Text)
     state: str = sa.Column(sa.Text)
     data: typing.Mapping[str, typing.Any] = sa.Column(
         JSONB, nullable=False, server_default="{}"
@@ -45,6 +46,16 @@ class Worker(Base):
     skill: str = sa.Column(sa.Enum(*WORKER_SKILL, name="worker_skill"), nullable=False)
     payment: int = sa.Column(sa.Integer, sa.CheckConstraint("payment > 0"))
     task_id: str = sa.Column(UUID(), sa.ForeignKey("tasks.id"))
+    latitude: float = sa.Column(sa.Float)
+    longitude: float = sa.Column(sa.Float)
+
+    __table_args__ = (
+        sa.Index(
+            "ix_workers_skill_idle",
+            skill,
+            postgresql_where=sa.and_(task_id == None, id != None),  # noqa: E711
+        ),
+    )
 
 
 class TaskType(Base):
@@ -64,23 +75,65 @@ class Task(Base):
         UUID(), primary_key=True, server_default=sa.func.gen_random_uuid()
     )
     location: str = sa.Column(sa.Text)
+    latitude: float = sa.Column(sa.Float)
+    longitude: float = sa.Column(sa.Float)
     time: datetime = sa.Column(sa.TIMESTAMP(timezone=True), default=current_timestamp())
     contact: str = sa.Column(sa.Text)
     comment: str = sa.Column(sa.Text)
     type_id: str = sa.Column(UUID(), sa.ForeignKey("task_types.id"))
     payment: int = sa.Column(sa.Integer, sa.CheckConstraint("payment > 0"))
     comments: str = sa.Column(sa.Text)
-    worker_id: int = sa.Column(sa.BigInteger, sa.ForeignKey("workers.id"))
+    worker_id: int = sa.Column(sa.BigInteger, sa.ForeignKey("workers.id"), index=True)
     timeliness: str = sa.Column(sa.Enum(*TASK_TIMELINESS, name="task_timeliness"))
     sent: bool = sa.Column(sa.Boolean, nullable=False, server_default=sa.false())
+    cancelled: bool = sa.Column(
+        sa.Boolean, nullable=False, default=False, server_default=sa.false()
+    )
+    wave: int = sa.Column(sa.Integer, nullable=False, default=0, server_default="0")
+    next_wave_at: datetime = sa.Column(sa.TIMESTAMP(timezone=True))
+
+    __table_args__ = (
+        sa.Index(
+            "ix_tasks_time_unverified",
+            time,
+            postgresql_where=sa.and_(
+                worker_id != None, timeliness == None  # noqa: E711
+            ),
+        ),
+        sa.Index(
+            "ix_tasks_time_unstarted",
+            time,
+            postgresql_where=sa.and_(
+                worker_id != None, timeliness != None, sa.not_(sent)  # noqa: E711
+            ),
+        ),
+        sa.Index(
+            "ix_tasks_next_wave_at",
+            next_wave_at,
+            postgresql_where=sa.and_(
+                worker_id == None, next_wave_at != None  # noqa: E711
+            ),
+        ),
+    )
 
 
 class TaskMessage(Base):
     __tablename__ = "task_messages"
 
     id: int = sa.Column(sa.BigInteger, primary_key=True)
-    task_id: str = sa.Column(UUID(), sa.ForeignKey("tasks.id"))
-    worker_id: int = sa.Column(sa.BigInteger, sa.ForeignKey("workers.id"))
+    task_id: str = sa.Column(UUID(), sa.ForeignKey("tasks.id"), index=True)
+    worker_id: int = sa.Column(
+        sa.BigInteger, sa.ForeignKey("workers.id"), primary_key=True
+    )
+
+
+class TaskOffer(Base):
+    __tablename__ = "task_offers"
+
+    task_id: str = sa.Column(UUID(), sa.ForeignKey("tasks.id"), primary_key=True)
+    worker_id: int = sa.Column(
+        sa.BigInteger, sa.ForeignKey("workers.id"), primary_key=True
+    )
 
 
 class Report(Base):
@@ -92,3 +145,25 @@ class Report(Base):
     task_id: str = sa.Column(UUID(), sa.ForeignKey("tasks.id"))
     worker_id: int = sa.Column(sa.BigInteger, sa.ForeignKey("workers.id"))
     photo: str = sa.Column(sa.Text)
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+
+    id: int = sa.Column(sa.BigInteger, primary_key=True)
+    chat_id: int = sa.Column(sa.BigInteger, nullable=False)
+    method: str = sa.Column(sa.Text, nullable=False)
+    payload: typing.Mapping[str, typing.Any] = sa.Column(
+        JSONB, nullable=False, server_default="{}"
+    )
+    task_id: str = sa.Column(UUID(), sa.ForeignKey("tasks.id"))
+    created_at: datetime = sa.Column(
+        sa.TIMESTAMP(timezone=True), nullable=False, server_default=current_timestamp()
+    )
+    attempts: int = sa.Column(sa.Integer, nullable=False, server_default="0")
+    next_attempt_at: datetime = sa.Column(
+        sa.TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=current_timestamp(),
+        index=True,
+    )
@@ -0,0 +1,356 @@
+import asyncio
+import datetime
+import logging
+import typing
+
+import sqlalchemy as sa
+import sqlalchemy.ext.asyncio
+from aiogram.utils import exceptions
+from sqlalchemy.dialects.postgresql import insert
+
+from cradlex import config
+from cradlex import database
+from cradlex import metrics
+from cradlex import models
+from cradlex.bot import bot
+from cradlex.i18n import _
+from cradlex.i18n import user_locale
+from cradlex.sender import sender
+
+
+#: Maximum number of messages inserted by one statement.
+INSERT_BATCH_SIZE = 1000
+#: Errors meaning that message to delete or edit doesn't exist anymore.
+GONE_ERRORS = (
+    exceptions.MessageToDeleteNotFound,
+    exceptions.MessageToEditNotFound,
+    exceptions.MessageNotModified,
+)
+
+wakeup_event = asyncio.Event()
+
+
+def message(
+    chat_id: int,
+    method: str,
+    *,
+    task_id: typing.Optional[str] = None,
+    **payload: typing.Any,
+) -> typing.Dict[str, typing.Any]:
+    """Create outbox row calling bot API ``method`` for ``chat_id``.
+
+    ``payload`` contains keyword arguments of ``method`` and must be
+    JSON serializable. ``task_id`` is set for offers of a task and for
+    their retractions. Sent offers are saved in ``task_messages``.
+    """
+    return {
+        "chat_id": chat_id,
+        "method": method,
+        "payload": payload,
+        "task_id": task_id,
+    }
+
+
+async def enqueue(
+    session: sa.ext.asyncio.AsyncSession, *messages: typing.Mapping[str, typing.Any]
+) -> None:
+    """Add ``messages`` to outbox in transaction of ``session``.
+
+    Messages are delivered after the transaction is committed.
+    """
+    for offset in range(0, len(messages), INSERT_BATCH_SIZE):
+        await session.execute(
+            sa.insert(models.OutboxMessage).values(
+                messages[offset : offset + INSERT_BATCH_SIZE]
+            )
+        )
+    session.info["outbox"] = True
+
+
+@sa.event.listens_for(sa.orm.Session, "after_commit")
+def wakeup_drainers(session: sa.orm.Session) -> None:
+    if session.info.pop("outbox", False):
+        wakeup_event.set()
+
+
+@sa.event.listens_for(sa.orm.Session, "after_rollback")
+def forget_messages(session: sa.orm.Session) -> None:
+    session.info.pop("outbox", None)
+
+
+async def claim(limit: int) -> typing.List[sa.engine.Row]:
+    """Lease at most ``limit`` due messages for delivery.
+
+    Leased messages are hidden from other drainers for ``OUTBOX_LEASE``
+    seconds and are delivered again if they are not deleted by then.
+    """
+    now = sa.func.current_timestamp()
+    async with database.sessionmaker() as session:
+        async with session.begin():
+            cursor = await session.execute(
+                sa.update(models.OutboxMessage)
+                .where(
+                    models.OutboxMessage.id.in_(
+                        sa.select(models.OutboxMessage.id)
+                        .where(models.OutboxMessage.next_attempt_at <= now)
+                        .order_by(models.OutboxMessage.id)
+                        .limit(limit)
+                        .with_for_update(skip_locked=True)
+                    )
+                )
+                .values(
+                    next_attempt_at=now
+                    + datetime.timedelta(seconds=config.OUTBOX_LEASE)
+                )
+                .returning(*models.OutboxMessage.__table__.columns)
+                .execution_options(synchronize_session=False)
+            )
+            return cursor.all()
+
+
+async def keep_leases(row_ids: typing.Sequence[int]) -> None:
+    """Renew leases of messages ``row_ids`` until cancelled.
+
+    Delivery of a batch can take longer than ``OUTBOX_LEASE`` when the
+    sender is parked by flood control, and messages with expired lease
+    would be claimed and sent again by another drainer.
+    """
+    while True:
+        await asyncio.sleep(config.OUTBOX_LEASE / 2)
+        try:
+            async with database.sessionmaker() as session:
+                async with session.begin():
+                    await session.execute(
+                        sa.update(models.OutboxMessage)
+                        .where(models.OutboxMessage.id.in_(row_ids))
+                        .values(
+                            next_attempt_at=sa.func.current_timestamp()
+                            + datetime.timedelta(seconds=config.OUTBOX_LEASE)
+                        )
+                        .execution_options(synchronize_session=False)
+                    )
+        except Exception as error:
+            logging.getLogger(__name__).error(f"Error renewing leases: {error}")
+
+
+async def deliver(row: sa.engine.Row) -> typing.Any:
+    return await sender.send(getattr(bot, row.method), row.chat_id, **row.payload)
+
+
+def retry_delay(row: sa.engine.Row, error: Exception) -> typing.Optional[float]:
+    """Get seconds to wait before delivering ``row`` again after ``error``.
+
+    Return ``None`` if delivery should not be retried.
+    """
+    if isinstance(error, exceptions.RetryAfter):
+        sender.park(row.chat_id, error.timeout)
+        metrics.increment("outbox.retry_after")
+        return error.timeout
+    if not isinstance(
+        error,
+        (exceptions.NetworkError, exceptions.RestartingTelegram, asyncio.TimeoutError),
+    ):
+        return None
+    if row.attempts + 1 >= config.OUTBOX_MAX_ATTEMPTS:
+        return None
+    metrics.increment("outbox.network_error")
+    return min(
+        config.OUTBOX_RETRY_DELAY * 2 ** row.attempts, config.OUTBOX_MAX_RETRY_DELAY
+    )
+
+
+async def enqueue_stubs(
+    session: sa.ext.asyncio.AsyncSession, rows: typing.Sequence[sa.engine.Row]
+) -> None:
+    """Enqueue replacing retracted offers ``rows`` with a stub.
+
+    Used for offers which are too old to be deleted. Stub tells whether
+    the task was taken, cancelled or expired.
+    """
+    users_cursor = await session.execute(
+        sa.select(models.User.id, models.User.language_code).where(
+            models.User.id.in_({row.chat_id for row in rows})
+        )
+    )
+    language_codes = {user_id: language_code for user_id, language_code in users_cursor}
+    tasks_cursor = await session.execute(
+        sa.select(
+            models.Task.id,
+            sa.case(
+                (models.Task.worker_id != None, "offer_taken"),  # noqa: E711
+                (models.Task.cancelled, "offer_cancelled"),
+                else_="offer_expired",
+            ),
+        ).where(models.Task.id.in_({row.task_id for row in rows}))
+    )
+    stub_texts = {task_id: stub_text for task_id, stub_text in tasks_cursor}
+    await enqueue(
+        session,
+        *(
+            message(
+                row.chat_id,
+                "edit_message_text",
+                message_id=row.payload["message_id"],
+                text=_(
+                    stub_texts.get(row.task_id, "offer_expired"),
+                    locale=user_locale(language_codes.get(row.chat_id)),
+                ),
+            )
+            for row in rows
+        ),
+    )
+
+
+async def deliver_batch(rows: typing.Sequence[sa.engine.Row]) -> None:
+    """Deliver leased ``rows`` and remove them from outbox.
+
+    Leases of ``rows`` are renewed while they are being delivered.
+    Rows failed with temporary errors are delivered again later.
+    Offers of tasks which were taken, cancelled or expired while being
+    sent are retracted.
+    Retracted offers which are already deleted are skipped and the ones
+    which can't be deleted anymore are edited into a stub instead.
+    Number of retracted offers and total time from enqueueing to
+    retraction in milliseconds are exposed as ``outbox.retracted`` and
+    ``outbox.retraction_ms`` metrics.
+    """
+    lease_keeper = asyncio.create_task(keep_leases([row.id for row in rows]))
+    try:
+        results = await asyncio.gather(*map(deliver, rows), return_exceptions=True)
+    finally:
+        lease_keeper.cancel()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    done = []
+    retried = []
+    offers = []
+    stubs = []
+    for row, result in zip(rows, results):
+        if row.method == "delete_message" and isinstance(
+            result, exceptions.MessageCantBeDeleted
+        ):
+            metrics.increment("outbox.stubbed")
+            done.append(row.id)
+            stubs.append(row)
+            continue
+        if isinstance(result, GONE_ERRORS):
+            metrics.increment("outbox.gone")
+            result = None
+        if not isinstance(result, Exception):
+            metrics.increment("outbox.sent")
+            done.append(row.id)
+            if row.method == "delete_message":
+                metrics.increment("outbox.retracted")
+                metrics.increment(
+                    "outbox.retraction_ms",
+                    round((now - row.created_at).total_seconds() * 1000),
+                )
+            if row.task_id is not None and row.method == "send_message":
+                offers.append(
+                    {
+                        "id": result.message_id,
+                        "task_id": row.task_id,
+                        "worker_id": row.chat_id,
+                    }
+                )
+            continue
+        delay = retry_delay(row, result)
+        if delay is None:
+            metrics.increment("outbox.failed")
+            done.append(row.id)
+            logging.getLogger(__name__).error(
+                f"Error calling {row.method} for chat {row.chat_id}: {result}"
+            )
+        else:
+            metrics.increment("outbox.retried")
+            retried.append(
+                {
+                    "row_id": row.id,
+                    "next_attempt_at": now + datetime.timedelta(seconds=delay),
+                }
+            )
+            logging.getLogger(__name__).warning(
+                f"Retrying {row.method} for chat {row.chat_id} "
+                f"in {delay} seconds: {result}"
+            )
+    async with database.sessionmaker() as session:
+        async with session.begin():
+            if retried:
+                outbox = models.OutboxMessage.__table__
+                await session.execute(
+                    sa.update(outbox)
+                    .where(outbox.c.id == sa.bindparam("row_id"))
+                    .values(
+                        attempts=outbox.c.attempts + 1,
+                        next_attempt_at=sa.bindparam("next_attempt_at"),
+                    ),
+                    retried,
+                )
+            await session.execute(
+                sa.delete(models.OutboxMessage).where(models.OutboxMessage.id.in_(done))
+            )
+            if stubs:
+                await enqueue_stubs(session, stubs)
+            if not offers:
+                return
+            taken_cursor = await session.execute(
+                sa.select(models.Task.id, models.Task.worker_id).where(
+                    models.Task.id.in_({offer["task_id"] for offer in offers}),
+                    sa.or_(
+                        models.Task.worker_id != None,  # noqa: E711
+                        models.Task.cancelled,
+                        models.Task.time <= sa.func.current_timestamp(),
+                    ),
+                )
+            )
+            taken = {task_id: worker_id for task_id, worker_id in taken_cursor}
+            retracted = [
+                offer
+                for offer in offers
+                if taken.get(offer["task_id"], offer["worker_id"]) != offer["worker_id"]
+            ]
+            offers = [offer for offer in offers if offer not in retracted]
+            if offers:
+                await session.execute(
+                    insert(models.TaskMessage).values(offers).on_conflict_do_nothing()
+                )
+            await enqueue(
+                session,
+                *(
+                    message(
+                        offer["worker_id"],
+                        "delete_message",
+                        task_id=offer["task_id"],
+                        message_id=offer["id"],
+                    )
+                    for offer in retracted
+                ),
+            )
+
+
+async def drain() -> None:
+    """Deliver messages from outbox until cancelled.
+
+    Nothing is claimed while sender is parked by flood control, so that
+    other instances can deliver messages in the meantime.
+    """
+    while True:
+        wakeup_event.clear()
+        parked = sender.global_bucket.parked()
+        if parked > 0:
+            await asyncio.sleep(parked)
+        try:
+            rows = await claim(config.OUTBOX_BATCH_SIZE)
+            if rows:
+                await deliver_batch(rows)
+                continue
+        except Exception as error:
+            logging.getLogger(__name__).error(f"Error draining outbox: {error}")
+        try:
+            await asyncio.wait_for(wakeup_event.wait(), config.OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_drainers() -> None:
+    for _i in range(config.OUTBOX_WORKERS):
+        asyncio.create_task(drain())
@@ -0,0 +1,423 @@
+import asyncio
+import datetime
+import functools
+import heapq
+import logging
+import time
+import typing
+
+import sqlalchemy as sa
+import sqlalchemy.ext.asyncio
+from aiogram import types
+
+from cradlex import config
+from cradlex import database
+from cradlex import metrics
+from cradlex import models
+from cradlex import outbox
+from cradlex import utils
+from cradlex.dispatch import workers
+from cradlex.i18n import _
+from cradlex.i18n import user_locale
+from cradlex.markup import markups
+
+
+#: Time before task when worker is asked to verify it.
+VERIFY_ADVANCE = datetime.timedelta(minutes=30)
+#: Channel notified by database trigger when task is created or changed.
+TASK_CHANNEL = "task_changes"
+
+deadlines: typing.List[typing.Tuple[datetime.datetime, str]] = []
+scheduled: typing.Set[typing.Tuple[datetime.datetime, str]] = set()
+changed_tasks: typing.Set[str] = set()
+#: Monotonic time of the next reload of all deadlines.
+resync_at = 0.0
+#: Difference between database clock and local clock.
+clock_offset = datetime.timedelta()
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc) + clock_offset
+
+
+def on_task_change(task_id: str) -> None:
+    changed_tasks.add(task_id)
+
+
+def schedule(when: datetime.datetime, task_id: str) -> None:
+    entry = (when, task_id)
+    if entry not in scheduled:
+        scheduled.add(entry)
+        heapq.heappush(deadlines, entry)
+
+
+def pending() -> sa.sql.ClauseElement:
+    """Get condition of tasks which have deadlines.
+
+    Every branch repeats predicate of a partial index exactly, so that
+    Postgres combines the indexes instead of scanning the whole history.
+    """
+    return sa.or_(
+        sa.and_(
+            models.Task.worker_id != None,  # noqa: E711
+            models.Task.timeliness == None,  # noqa: E711
+        ),
+        sa.and_(
+            models.Task.worker_id != None,  # noqa: E711
+            models.Task.timeliness != None,  # noqa: E711
+            ~models.Task.sent,
+        ),
+        sa.and_(
+            models.Task.worker_id == None,  # noqa: E711
+            models.Task.next_wave_at != None,  # noqa: E711
+        ),
+    )
+
+
+async def load_deadlines(task_ids: typing.Optional[typing.Iterable[str]] = None):
+    """Schedule deadlines of pending tasks.
+
+    Load deadlines of all pending tasks if ``task_ids`` is ``None``.
+    """
+    global clock_offset
+    query = sa.select(
+        models.Task.id,
+        models.Task.time,
+        models.Task.timeliness,
+        models.Task.worker_id,
+        models.Task.next_wave_at,
+        sa.func.current_timestamp(),
+    ).where(pending())
+    if task_ids is not None:
+        query = query.where(models.Task.id.in_(task_ids))
+    async with database.sessionmaker() as session:
+        async with session.begin():
+            cursor = await session.execute(query)
+            rows = cursor.all()
+    for task_id, task_time, timeliness, worker_id, next_wave_at, database_time in rows:
+        clock_offset = database_time - datetime.datetime.now(datetime.timezone.utc)
+        if worker_id is None:
+            schedule(next_wave_at, task_id)
+            continue
+        if timeliness is None:
+            schedule(task_time - VERIFY_ADVANCE, task_id)
+        schedule(task_time, task_id)
+
+
+@markups.builder("timeliness")
+def timeliness_markup() -> types.ReplyKeyboardMarkup:
+    keyboard_markup = types.ReplyKeyboardMarkup(one_time_keyboard=True, row_width=1)
+    clocks = models.TASK_TIMELINESS
+    keyboard_markup.add(
+        types.KeyboardButton(f"{clocks['on_time']} {_('on_time')}"),
+        types.KeyboardButton(f"{clocks['late']} {_('late')}"),
+        types.KeyboardButton(f"{clocks['very_late']} {_('very_late')}"),
+    )
+    return keyboard_markup
+
+
+@markups.builder("task_started")
+def start_markup() -> types.InlineKeyboardMarkup:
+    keyboard_markup = types.InlineKeyboardMarkup(one_time_keyboard=True, row_width=1)
+    keyboard_markup.add(
+        types.InlineKeyboardButton(_("task_done"), callback_data="task_done"),
+    )
+    return keyboard_markup
+
+
+def unverified() -> typing.Tuple[sa.sql.ClauseElement, ...]:
+    """Get conditions of tasks which should be verified by workers."""
+    return (
+        models.Task.time <= sa.func.current_timestamp() + VERIFY_ADVANCE,
+        models.Task.worker_id != None,  # noqa: E711
+        models.Task.timeliness == None,  # noqa: E711
+    )
+
+
+def unstarted() -> typing.Tuple[sa.sql.ClauseElement, ...]:
+    """Get conditions of tasks which should be started by workers."""
+    return (
+        models.Task.time <= sa.func.current_timestamp(),
+        models.Task.worker_id != None,  # noqa: E711
+        models.Task.timeliness != None,  # noqa: E711
+        sa.not_(models.Task.sent),
+    )
+
+
+async def claim_tasks(
+    session: sa.ext.asyncio.AsyncSession,
+    values: typing.Mapping[str, typing.Any],
+    *conditions: sa.sql.ClauseElement,
+) -> typing.List[sa.engine.Row]:
+    """Update at most ``SCHEDULER_BATCH_SIZE`` earliest due tasks.
+
+    Tasks matching ``conditions`` are updated with ``values``. Tasks
+    locked by other replicas are skipped, so replicas running
+    concurrently split due tasks instead of waiting for each other.
+    Return IDs and language codes of workers of updated tasks.
+    """
+    cursor = await session.execute(
+        sa.update(models.Task)
+        .where(
+            models.Task.id.in_(
+                sa.select(models.Task.id)
+                .where(*conditions)
+                .order_by(models.Task.time)
+                .limit(config.SCHEDULER_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )
+        )
+        .values(**values)
+        .returning(
+            models.Task.worker_id,
+            sa.select(models.User.language_code)
+            .where(models.User.id == models.Task.worker_id)
+            .scalar_subquery()
+            .label("language_code"),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return cursor.all()
+
+
+async def notify_batch(session: sa.ext.asyncio.AsyncSession) -> int:
+    """Ask workers of a batch of due tasks to verify or start them.
+
+    Return number of notified workers.
+    """
+    timeliness_rows = await claim_tasks(
+        session, {"timeliness": "unknown"}, *unverified()
+    )
+    start_rows = await claim_tasks(session, {"sent": True}, *unstarted())
+    await outbox.enqueue(
+        session,
+        *(
+            outbox.message(
+                row.worker_id,
+                "send_message",
+                text=_("verify_task", locale=user_locale(row.language_code)),
+                reply_markup=markups.get("timeliness", user_locale(row.language_code)),
+            )
+            for row in timeliness_rows
+        ),
+        *(
+            outbox.message(
+                row.worker_id,
+                "send_message",
+                text=_("task_started", locale=user_locale(row.language_code)),
+                reply_markup=markups.get(
+                    "task_started", user_locale(row.language_code)
+                ),
+            )
+            for row in start_rows
+        ),
+    )
+    return len(timeliness_rows) + len(start_rows)
+
+
+async def notify_workers() -> None:
+    """Ask workers of all due tasks to verify or start them.
+
+    Every batch is committed separately so that its messages are sent
+    while the next one is claimed. Number of due tasks left is exposed
+    as ``scheduler.backlog`` metric.
+    """
+    async with database.sessionmaker() as session:
+        async with session.begin():
+            backlog = await session.scalar(
+                sa.select(
+                    sa.select(sa.func.count()).where(*unverified()).scalar_subquery()
+                    + sa.select(sa.func.count()).where(*unstarted()).scalar_subquery()
+                )
+            )
+    metrics.set_gauge("scheduler.backlog", backlog)
+    while True:
+        async with database.sessionmaker() as session:
+            async with session.begin():
+                notified = await notify_batch(session)
+        metrics.increment("scheduler.notified", notified)
+        backlog = max(backlog - notified, 0)
+        metrics.set_gauge("scheduler.backlog", backlog)
+        if notified < config.SCHEDULER_BATCH_SIZE:
+            break
+    metrics.set_gauge("scheduler.backlog", 0)
+
+
+async def send_waves() -> None:
+    """Offer all tasks due for the next wave to more workers."""
+    while True:
+        async with database.sessionmaker() as session:
+            async with session.begin():
+                cursor = await session.execute(
+                    sa.select(models.Task)
+                    .where(
+                        models.Task.worker_id == None,  # noqa: E711
+                        models.Task.next_wave_at <= sa.func.current_timestamp(),
+                        models.Task.time > sa.func.current_timestamp(),
+                        sa.not_(models.Task.cancelled),
+                    )
+                    .order_by(models.Task.next_wave_at)
+                    .limit(config.SCHEDULER_BATCH_SIZE)
+                    .with_for_update(skip_locked=True)
+                )
+                tasks = cursor.scalars().all()
+                for task in tasks:
+                    await utils.broadcast_task(session, task)
+        if len(tasks) < config.SCHEDULER_BATCH_SIZE:
+            break
+
+
+async def sweep() -> None:
+    """Retract offers of all cancelled and expired untaken tasks.
+
+    Tasks are looked up by their offers rather than by time, so swept
+    tasks are not scanned again however long the history is.
+    Tasks are swept in batches of ``SCHEDULER_BATCH_SIZE``, each one
+    committed separately. Tasks locked by other replicas are skipped.
+    Number of retracted messages is exposed as ``scheduler.swept``
+    metric.
+    """
+    while True:
+        async with database.sessionmaker() as session:
+            async with session.begin():
+                cursor = await session.execute(
+                    sa.select(models.Task.id)
+                    .where(
+                        models.Task.id.in_(
+                            sa.union(
+                                sa.select(models.TaskOffer.task_id),
+                                sa.select(models.TaskMessage.task_id),
+                            )
+                        ),
+                        models.Task.worker_id == None,  # noqa: E711
+                        sa.or_(
+                            models.Task.cancelled,
+                            models.Task.time <= sa.func.current_timestamp(),
+                        ),
+                    )
+                    .order_by(models.Task.time)
+                    .limit(config.SCHEDULER_BATCH_SIZE)
+                    .with_for_update(of=models.Task, skip_locked=True)
+                )
+                task_ids = cursor.scalars().all()
+                if task_ids:
+                    swept = await utils.retract_offers(session, task_ids)
+                    metrics.increment("scheduler.swept", swept)
+        if len(task_ids) < config.SCHEDULER_BATCH_SIZE:
+            break
+
+
+async def release_workers() -> None:
+    """Release workers of tasks which are not reviewed in time.
+
+    Worker is released if their task was due more than
+    ``SCHEDULER_RELEASE_DELAY`` seconds ago, so that workers who never
+    sent a photo or whose photo was never reviewed get offers again.
+    Task itself keeps the worker. Number of released workers is exposed
+    as ``scheduler.released`` metric.
+    """
+    while True:
+        async with database.sessionmaker() as session:
+            async with session.begin():
+                cursor = await session.execute(
+                    sa.update(models.Worker)
+                    .where(
+                        models.Worker.id.in_(
+                            sa.select(models.Worker.id)
+                            .join(
+                                models.Task,
+                                onclause=models.Task.id == models.Worker.task_id,
+                            )
+                            .where(
+                                models.Task.time
+                                <= sa.func.current_timestamp()
+                                - datetime.timedelta(
+                                    seconds=config.SCHEDULER_RELEASE_DELAY
+                                )
+                            )
+                            .limit(config.SCHEDULER_BATCH_SIZE)
+                            .with_for_update(of=models.Worker, skip_locked=True)
+                        )
+                    )
+                    .values(task_id=None)
+                    .returning(
+                        models.Worker.id,
+                        models.Worker.skill,
+                        sa.select(models.User.language_code)
+                        .where(models.User.id == models.Worker.id)
+                        .scalar_subquery()
+                        .label("language_code"),
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                rows = cursor.all()
+                for row in rows:
+                    database.on_commit(
+                        session, functools.partial(workers.set_idle, row.id, row.skill)
+                    )
+                await outbox.enqueue(
+                    session,
+                    *(
+                        outbox.message(
+                            row.id,
+                            "send_message",
+                            text=_(
+                                "task_released", locale=user_locale(row.language_code)
+                            ),
+                        )
+                        for row in rows
+                    ),
+                )
+        metrics.increment("scheduler.released", len(rows))
+        if len(rows) < config.SCHEDULER_BATCH_SIZE:
+            break
+
+
+async def sweep_periodically(interval: float) -> None:
+    """Sweep offers of expired tasks and release workers of overdue
+    tasks every ``interval`` seconds until cancelled."""
+    while True:
+        try:
+            await sweep()
+            await release_workers()
+        except Exception as error:
+            logging.getLogger(__name__).error(f"Error sweeping tasks: {error}")
+        await asyncio.sleep(interval)
+
+
+async def sync(reconnected: bool) -> float:
+    """Reload changed deadlines and notify workers of due tasks.
+
+    Return seconds until the next deadline or resync.
+    """
+    global resync_at
+    if reconnected or time.monotonic() >= resync_at:
+        changed_tasks.clear()
+        deadlines.clear()
+        scheduled.clear()
+        await load_deadlines()
+        resync_at = time.monotonic() + config.SCHEDULER_RESYNC_INTERVAL
+    elif changed_tasks:
+        task_ids = list(changed_tasks)
+        changed_tasks.clear()
+        await load_deadlines(task_ids)
+    if deadlines and deadlines[0][0] <= now():
+        while deadlines and deadlines[0][0] <= now():
+            scheduled.discard(heapq.heappop(deadlines))
+        await notify_workers()
+        await send_waves()
+    timeout = resync_at - time.monotonic()
+    if deadlines:
+        timeout = min(timeout, (deadlines[0][0] - now()).total_seconds())
+    return timeout
+
+
+async def run() -> None:
+    """Notify workers about their tasks and offer untaken tasks to next
+    waves of workers exactly when they are due.
+
+    Deadlines are kept in a heap and updated on database notifications.
+    All deadlines are reloaded every ``SCHEDULER_RESYNC_INTERVAL``
+    seconds and whenever notifications might have been missed.
+    """
+    await database.follow(TASK_CHANNEL, on_task_change, sync, "in task loop")
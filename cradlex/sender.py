@@ -0,0 +1,116 @@
+import asyncio
+import time
+import typing
+
+from cradlex import config
+
+
+class TokenBucket:
+    """Token bucket limiting the rate of some action.
+
+    Bucket is refilled with ``rate`` tokens per second up to ``capacity``
+    tokens. Waiting for a token is fair: waiters are served in order.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.parked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def idle(self) -> bool:
+        """Whether bucket is full and nobody waits for it."""
+        self.refill()
+        return (
+            self.tokens >= self.capacity
+            and not self.lock.locked()
+            and self.parked_until <= time.monotonic()
+        )
+
+    def park(self, seconds: float) -> None:
+        """Give out no tokens for ``seconds``."""
+        self.parked_until = max(self.parked_until, time.monotonic() + seconds)
+
+    def parked(self) -> float:
+        """Get seconds left until bucket gives out tokens again."""
+        return max(0.0, self.parked_until - time.monotonic())
+
+    async def acquire(self) -> None:
+        """Wait until token is available and take it."""
+        async with self.lock:
+            parked = self.parked()
+            if parked > 0:
+                await asyncio.sleep(parked)
+            self.refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+
+class Sender:
+    """Process-wide scheduler of outbound Telegram requests.
+
+    Requests are limited by global token bucket shared by all chats,
+    by token bucket of each chat and by number of concurrent requests.
+    """
+
+    #: Number of chat buckets after which idle ones are discarded.
+    CHAT_BUCKETS_LIMIT = 10000
+
+    def __init__(self, global_rate: float, chat_rate: float, concurrency: int):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets: typing.Dict[int, TokenBucket] = {}
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.CHAT_BUCKETS_LIMIT:
+                self.chat_buckets = {
+                    key: value
+                    for key, value in self.chat_buckets.items()
+                    if not value.idle
+                }
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    def park(self, chat_id: int, seconds: float) -> None:
+        """Stop sending to ``chat_id`` and to all chats for ``seconds``.
+
+        Telegram doesn't tell whether flood control is exceeded for one
+        chat or for the whole bot, so both buckets are parked.
+        """
+        self.chat_bucket(chat_id).park(seconds)
+        self.global_bucket.park(seconds)
+
+    async def send(
+        self,
+        method: typing.Callable[..., typing.Awaitable[typing.Any]],
+        chat_id: int,
+        **kwargs: typing.Any,
+    ) -> typing.Any:
+        """Call bot API ``method`` for ``chat_id`` when limits allow it.
+
+        Example: ``await sender.send(bot.send_message, chat_id, text=text)``
+        """
+        await self.chat_bucket(chat_id).acquire()
+        async with self.semaphore:
+            await self.global_bucket.acquire()
+            return await method(chat_id=chat_id, **kwargs)
+
+
+sender = Sender(
+    global_rate=config.SEND_GLOBAL_RATE,
+    chat_rate=config.SEND_CHAT_RATE,
+    concurrency=config.SEND_CONCURRENCY,
+)
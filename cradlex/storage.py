@@ -0,0 +1,176 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import sqlite3
+import typing
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
+
+from cradlex import config
+from cradlex import database
+
+
+class SnapshotMemoryStorage(MemoryStorage):
+    """In-memory storage of FSM state and data.
+
+    If ``filename`` is set, storage is loaded from it on creation and
+    saved to it periodically and on close.
+    """
+
+    def __init__(self, filename: typing.Optional[str] = None):
+        super().__init__()
+        self.filename = filename
+        if filename is not None and os.path.exists(filename):
+            with open(filename, "r") as snapshot_file:
+                self.data = json.load(snapshot_file)
+
+    async def save_snapshot(self) -> None:
+        if self.filename is None:
+            return
+        snapshot = json.dumps(self.data)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.write_snapshot, snapshot
+        )
+
+    def write_snapshot(self, snapshot: str) -> None:
+        if self.filename is None:
+            return
+        temporary_filename = self.filename + ".tmp"
+        with open(temporary_filename, "w") as snapshot_file:
+            snapshot_file.write(snapshot)
+        os.replace(temporary_filename, self.filename)
+
+    async def save_periodically(self, interval: float) -> None:
+        """Save snapshot every ``interval`` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.save_snapshot()
+            except Exception as error:
+                logging.getLogger(__name__).error(
+                    f"Error saving storage snapshot: {error}"
+                )
+
+    async def close(self):
+        await self.save_snapshot()
+        await super().close()
+
+
+class SQLiteStorage(BaseStorage):
+    """Storage of FSM state and data in local SQLite database.
+
+    All queries are executed in a single dedicated thread.
+    """
+
+    def __init__(self, filename: str):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.connection = self.executor.submit(self.connect, filename).result()
+
+    @staticmethod
+    def connect(filename: str) -> sqlite3.Connection:
+        connection = sqlite3.connect(filename)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "user INTEGER PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')"
+        )
+        connection.commit()
+        return connection
+
+    async def run(
+        self, function: typing.Callable[..., typing.Any], *args
+    ) -> typing.Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, function, *args
+        )
+
+    def load(
+        self, user: int
+    ) -> typing.Tuple[typing.Optional[str], typing.Dict[str, typing.Any]]:
+        row = self.connection.execute(
+            "SELECT state, data FROM fsm WHERE user = ?", (user,)
+        ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def save(
+        self,
+        user: int,
+        state: typing.Optional[str],
+        data: typing.Mapping[str, typing.Any],
+    ) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO fsm (user, state, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (user) DO UPDATE "
+                "SET state = excluded.state, data = excluded.data",
+                (user, state, json.dumps(data)),
+            )
+
+    def change(
+        self,
+        user: int,
+        change: typing.Callable[
+            [typing.Optional[str], typing.Dict[str, typing.Any]],
+            typing.Tuple[typing.Optional[str], typing.Mapping[str, typing.Any]],
+        ],
+    ) -> None:
+        self.save(user, *change(*self.load(user)))
+
+    async def close(self):
+        await self.run(self.connection.close)
+        self.executor.shutdown(wait=False)
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user, **kwargs):
+        state, data = await self.run(self.load, user)
+        return state
+
+    async def get_data(self, *, chat=None, user, **kwargs):
+        state, data = await self.run(self.load, user)
+        return data
+
+    async def set_state(self, *, chat=None, user, state=None):
+        await self.run(self.change, user, lambda old_state, old_data: (state, old_data))
+
+    async def set_data(self, *, chat=None, user, data):
+        await self.run(self.change, user, lambda old_state, old_data: (old_state, data))
+
+    async def update_data(self, *, chat=None, user, data=None, **kwargs):
+        if data is None:
+            data = {}
+        data.update(kwargs)
+        await self.run(
+            self.change,
+            user,
+            lambda old_state, old_data: (old_state, {**old_data, **data}),
+        )
+
+    async def reset_state(self, *, chat=None, user, with_data=True):
+        await self.run(
+            self.change,
+            user,
+            lambda old_state, old_data: (None, {} if with_data else old_data),
+        )
+
+
+def create_storage() -> BaseStorage:
+    """Create FSM storage selected by ``STORAGE`` option."""
+    if config.STORAGE == "postgres":
+        return database.PostgreStorage()
+    elif config.STORAGE == "memory":
+        try:
+            filename = config.STORAGE_FILENAME
+        except AttributeError:
+            filename = None
+        return SnapshotMemoryStorage(filename)
+    elif config.STORAGE == "sqlite":
+        return SQLiteStorage(config.STORAGE_FILENAME)
+    else:
+        raise ValueError(f"unknown storage '{config.STORAGE}'")
@@ -1,43 +1,83 @@
+import functools
+
 import sqlalchemy as sa
 from aiogram import types
 from aiogram.dispatcher.middlewares import BaseMiddleware
+from sqlalchemy.dialects.postgresql import insert
 
 from cradlex import config
 from cradlex import database
 from cradlex import models
 from cradlex import states
+from cradlex.cache import LRUCache
 
 
 class UserMiddleware(BaseMiddleware):
+    """Save profiles of users sending updates.
+
+    Hashes of saved profiles are cached after commit, so profile is
+    written only if it has changed since the last update of the user.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.profiles: LRUCache[int, int] = LRUCache(
+            config.USER_CACHE_SIZE, config.USER_CACHE_TTL
+        )
+
     async def on_pre_process_update(self, update: types.Update, data: dict):
         update_user = None
         if update.message:
             update_user = update.message.from_user
         elif update.callback_query and update.callback_query.message:
             update_user = update.callback_query.from_user
-        if update_user:
-            database_user = models.User(
-                id=update_user.id,
-                first_name=update_user.first_name,
-                last_name=update_user.last_name,
-                username=update_user.username,
+        if not update_user:
+            return
+        profile_hash = hash(
+            (
+                update_user.first_name,
+                update_user.last_name,
+                update_user.username,
+                update_user.language_code,
+            )
+        )
+        if self.profiles.get(update_user.id) == profile_hash:
+            return
+        statement = insert(models.User).values(
+            id=update_user.id,
+            first_name=update_user.first_name,
+            last_name=update_user.last_name,
+            username=update_user.username,
+            language_code=update_user.language_code,
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[models.User.id],
+            set_={
+                "first_name": statement.excluded.first_name,
+                "last_name": statement.excluded.last_name,
+                "username": statement.excluded.username,
+                "language_code": statement.excluded.language_code,
+            },
+            where=sa.or_(
+                models.User.first_name.is_distinct_from(statement.excluded.first_name),
+                models.User.last_name.is_distinct_from(statement.excluded.last_name),
+                models.User.username.is_distinct_from(statement.excluded.username),
+                models.User.language_code.is_distinct_from(
+                    statement.excluded.language_code
+                ),
+            ),
+        ).returning(sa.literal_column("xmax = 0").label("created"))
+        async with database.transaction() as session:
+            created = await session.scalar(statement)
+            database.on_commit(
+                session,
+                functools.partial(self.profiles.set, update_user.id, profile_hash),
+            )
+        if created and update_user.id != config.OPERATOR_ID:
+            await self.manager.dispatcher.storage.set_state(
+                user=update_user.id,
+                state=states.Registration.first_message.state,
             )
-            if update_user.id != config.OPERATOR_ID:
-                database_user.state = states.Registration.first_message.state
-            async with database.sessionmaker() as session:
-                async with session.begin():
-                    update_result = await session.execute(
-                        sa.update(models.User)
-                        .where(models.User.id == database_user.id)
-                        .values(
-                            first_name=database_user.first_name,
-                            last_name=database_user.last_name,
-                            username=database_user.username,
-                        )
-                        .returning(sa.text("1"))
-                    )
-                    if not update_result.one_or_none():
-                        session.add(database_user)
 
 
 user_middleware = UserMiddleware()
@@ -1,21 +1,28 @@
-import asyncio
-import logging
 import re
 import typing
 from datetime import datetime
+from datetime import timedelta
 
 import phonenumbers
 import pytz
 import sqlalchemy as sa
+import sqlalchemy.ext.asyncio
 from aiogram import types
 from aiogram.utils.emoji import emojize
+from sqlalchemy.dialects.postgresql import insert
 
 from cradlex import callback_data
-from cradlex import database
+from cradlex import config
+from cradlex import metrics
 from cradlex import models
+from cradlex import outbox
 from cradlex import states
-from cradlex.bot import bot
+from cradlex.catalog import catalog
+from cradlex.dispatch import workers
 from cradlex.i18n import _
+from cradlex.i18n import use_locale
+from cradlex.i18n import user_locale
+from cradlex.markup import markups
 
 
 DATE_FORMAT = "%d.%m %H:%M"
@@ -35,6 +42,13 @@ def message_from_lines(lines: typing.Mapping[str, str], numbered: bool = False)
     return "\n".join(line_values)
 
 
+def shorten(text: str, length: int) -> str:
+    """Cut ``text`` to ``length`` characters marking the cut with ellipsis."""
+    if len(text) <= length:
+        return text
+    return text[: length - 1] + "…"
+
+
 def task_string(task_type: models.TaskType) -> str:
     name = task_type.name
     difficulty = models.TASK_DIFFICULTY.index(task_type.difficulty) + 1
@@ -53,32 +67,20 @@ def parse_task_type(text: str) -> typing.Optional[typing.Tuple[str, str]]:
         return None
 
 
-async def get_task_types_keyboard() -> types.ReplyKeyboardMarkup:
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            task_types_cursor = await session.execute(
-                sa.select(models.TaskType).order_by(
-                    models.TaskType.difficulty, models.TaskType.name
-                )
-            )
-            task_types = task_types_cursor.all()
+@markups.builder("task_types")
+def task_types_keyboard() -> types.ReplyKeyboardMarkup:
     keyboard_markup = types.ReplyKeyboardMarkup(
         row_width=1, one_time_keyboard=True, resize_keyboard=True
     )
-    for task_type in task_types:
-        keyboard_markup.add(types.KeyboardButton(task_string(task_type[0])))
+    for task_type in catalog.all():
+        keyboard_markup.add(types.KeyboardButton(task_string(task_type)))
     return keyboard_markup
 
 
 async def task_message_lines(
     task: typing.Mapping[str, typing.Any]
 ) -> typing.Dict[str, str]:
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            task_type_cursor = await session.execute(
-                sa.select(models.TaskType).where(models.TaskType.id == task["type_id"])
-            )
-            task_type_scalar = task_type_cursor.scalar_one()
+    task_type_scalar = await catalog.get(task["type_id"])
     if isinstance(task["time"], str):
         task_time = datetime.fromisoformat(task["time"])
     else:
@@ -149,52 +151,174 @@ async def worker_message(
     return message_from_lines(await worker_message_lines(worker))
 
 
-async def broadcast_task(task_id: str) -> None:
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            task_cursor = await session.execute(
-                sa.select(models.Task, models.TaskType.difficulty)
-                .join(models.TaskType)
-                .where(models.Task.id == task_id)
-            )
-            task, task_difficulty = task_cursor.one()
-            skill_index = models.TASK_DIFFICULTY.index(task_difficulty)
-            worker_ids_cursor = await session.execute(
-                sa.select(models.Worker.id).where(
-                    models.Worker.task_id == None,  # noqa: E711
-                    models.Worker.skill == models.WORKER_SKILL[skill_index],
-                )
-            )
-            worker_ids = worker_ids_cursor.scalars().all()
-    text = _("new_task") + "\n" + await task_message(task)
+@markups.builder("take_task")
+def take_task_keyboard(task_id: str) -> types.InlineKeyboardMarkup:
     keyboard_markup = types.InlineKeyboardMarkup()
     keyboard_markup.row(
         types.InlineKeyboardButton(
             _("take_task"),
-            callback_data=callback_data.take_task.new(task_id=task.id),
+            callback_data=callback_data.take_task.new(task_id=task_id),
+        )
+    )
+    return keyboard_markup
+
+
+async def broadcast_task(
+    session: sa.ext.asyncio.AsyncSession, task: models.Task
+) -> None:
+    """Enqueue offers of ``task`` to the next wave of workers in ``session``.
+
+    Wave consists of at most ``DISPATCH_WAVE_SIZE`` idle workers who
+    can do the task and were not offered it yet. If the task has
+    coordinates, the nearest workers are offered first. Then workers
+    with skill closest to task difficulty, the most tasks done on time
+    and the latest tasks are preferred. The next wave is scheduled in
+    ``DISPATCH_WAVE_TIMEOUT`` seconds if the task is still not taken.
+    """
+    task_type = await catalog.get(task.type_id)
+    on_time_count = (
+        sa.select(sa.func.count())
+        .where(
+            models.Task.worker_id == models.Worker.id,
+            models.Task.timeliness == "on_time",
+        )
+        .scalar_subquery()
+    )
+    last_task_time = (
+        sa.select(sa.func.max(models.Task.time))
+        .where(models.Task.worker_id == models.Worker.id)
+        .scalar_subquery()
+    )
+    order_by = [
+        models.Worker.skill,
+        on_time_count.desc(),
+        last_task_time.desc().nullslast(),
+    ]
+    if task.latitude is not None and task.longitude is not None:
+        nearest = workers.nearest(
+            (task.latitude, task.longitude),
+            config.DISPATCH_WAVE_SIZE * (task.wave + 1),
+            task_type.difficulty,
+        )
+        if nearest:
+            order_by.insert(
+                0,
+                sa.case(
+                    {worker_id: rank for rank, worker_id in enumerate(nearest)},
+                    value=models.Worker.id,
+                ).nullslast(),
+            )
+    workers_cursor = await session.execute(
+        sa.select(models.Worker.id, models.User.language_code)
+        .join(models.User, models.User.id == models.Worker.id)
+        .where(
+            models.Worker.id.in_(workers.eligible(task_type.difficulty)),
+            # In-memory pool might be stale.
+            models.Worker.task_id == None,  # noqa: E711
+            ~sa.exists().where(
+                sa.and_(
+                    models.TaskOffer.task_id == task.id,
+                    models.TaskOffer.worker_id == models.Worker.id,
+                )
+            ),
+        )
+        .order_by(*order_by)
+        .limit(config.DISPATCH_WAVE_SIZE)
+    )
+    texts: typing.Dict[str, str] = {}
+    offers = []
+    for worker_id, language_code in workers_cursor.all():
+        locale = user_locale(language_code)
+        if locale not in texts:
+            with use_locale(locale):
+                texts[locale] = _("new_task") + "\n" + await task_message(task)
+        offers.append(
+            outbox.message(
+                worker_id,
+                "send_message",
+                task_id=task.id,
+                text=texts[locale],
+                reply_markup=markups.get("take_task", locale, task_id=task.id),
+            )
+        )
+    if offers:
+        # Offered workers are remembered even if delivery fails, so
+        # unreachable ones don't take places of others in next waves.
+        await session.execute(
+            insert(models.TaskOffer)
+            .values(
+                [
+                    {"task_id": task.id, "worker_id": offer["chat_id"]}
+                    for offer in offers
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+    await outbox.enqueue(session, *offers)
+    next_wave_at = sa.func.current_timestamp() + timedelta(
+        seconds=config.DISPATCH_WAVE_TIMEOUT
+    )
+    await session.execute(
+        sa.update(models.Task)
+        .where(models.Task.id == task.id)
+        .values(
+            wave=models.Task.wave + 1,
+            next_wave_at=sa.case(
+                (next_wave_at < models.Task.time, next_wave_at), else_=None
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    metrics.increment("dispatch.waves")
+    metrics.increment("dispatch.offers", len(offers))
+
+
+async def delete_task_messages(
+    session: sa.ext.asyncio.AsyncSession, rows: typing.Iterable[sa.engine.Row]
+) -> None:
+    """Enqueue deletion of task offers ``rows`` in ``session``."""
+    await outbox.enqueue(
+        session,
+        *(
+            outbox.message(
+                row.worker_id, "delete_message", task_id=row.task_id, message_id=row.id
+            )
+            for row in rows
+        ),
+    )
+
+
+async def retract_offers(
+    session: sa.ext.asyncio.AsyncSession, task_ids: typing.Collection[str]
+) -> int:
+    """Retract all offers of tasks ``task_ids`` in ``session``.
+
+    Unsent offers are dropped from outbox and sent ones are deleted.
+    Return number of retracted messages.
+    """
+    await session.execute(
+        sa.delete(models.TaskOffer)
+        .where(models.TaskOffer.task_id.in_(task_ids))
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(
+        sa.delete(models.OutboxMessage)
+        .where(
+            models.OutboxMessage.task_id.in_(task_ids),
+            models.OutboxMessage.method == "send_message",
+        )
+        .execution_options(synchronize_session=False)
+    )
+    messages_cursor = await session.execute(
+        sa.delete(models.TaskMessage)
+        .where(models.TaskMessage.task_id.in_(task_ids))
+        .returning(
+            models.TaskMessage.worker_id,
+            models.TaskMessage.id,
+            models.TaskMessage.task_id,
         )
+        .execution_options(synchronize_session=False)
     )
-    async with database.sessionmaker() as session:
-        async with session.begin():
-            for worker_id in worker_ids:
-                try:
-                    message = await bot.send_message(
-                        worker_id, text, reply_markup=keyboard_markup
-                    )
-                    session.add(
-                        models.TaskMessage(
-                            id=message.message_id, task_id=task.id, worker_id=worker_id
-                        )
-                    )
-                except Exception as error:
-                    logging.getLogger(__name__).error(
-                        f"Error sending task {task.id} to worker {worker_id}: {error}"
-                    )
-                else:
-                    await asyncio.sleep(0.05)
-
-
-async def delete_task_messages(rows: typing.Iterable[sa.engine.Row]) -> None:
-    for row in rows:
-        await bot.delete_message(chat_id=row.worker_id, message_id=row.id)
-        await asyncio.sleep(0.05)
+    messages = messages_cursor.all()
+    await delete_task_messages(session, messages)
+    return len(messages)
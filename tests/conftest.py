@@ -0,0 +1,36 @@
+import os
+import tempfile
+
+import pytest
+
+
+# Options without defaults required to import cradlex modules.
+os.environ.setdefault("DATABASE_USERNAME", "cradlex")
+os.environ.setdefault("OPERATOR_ID", "1")
+if "TOKEN_FILENAME" not in os.environ:
+    token_fd, os.environ["TOKEN_FILENAME"] = tempfile.mkstemp()
+    with os.fdopen(token_fd, "w") as token_file:
+        token_file.write("123456:TEST-token")
+
+#: Whether database configured by ``DATABASE_*`` options may be used by
+#: tests. It must be migrated and is written to.
+TEST_DATABASE = os.getenv("TEST_DATABASE") == "true"
+
+
+def pytest_collection_modifyitems(config, items):
+    if TEST_DATABASE:
+        return
+    skip_database = pytest.mark.skip(reason="TEST_DATABASE is not set")
+    for item in items:
+        if "database" in item.keywords:
+            item.add_marker(skip_database)
+
+
+@pytest.fixture(autouse=True)
+async def dispose_engine(request):
+    """Close pooled connections bound to the event loop of the test."""
+    yield
+    if "database" in request.keywords:
+        from cradlex import database
+
+        await database.engine.dispose()
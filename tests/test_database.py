@@ -0,0 +1,76 @@
+import pytest
+import sqlalchemy as sa
+from aiogram import Bot
+from aiogram import Dispatcher
+from aiogram import types
+
+from cradlex import database
+from cradlex import models
+
+
+USER_ID = 900000001
+
+committed = []
+
+
+def message_update(update_id: int, text: str) -> types.Update:
+    return types.Update(
+        update_id=update_id,
+        message={
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": USER_ID, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    )
+
+
+@pytest.fixture
+async def dispatcher():
+    bot = Bot("123456:TEST-token")
+    dispatcher = Dispatcher(bot)
+    dispatcher.middleware.setup(database.SessionMiddleware())
+
+    @dispatcher.message_handler()
+    async def save_user(message: types.Message):
+        async with database.transaction() as session:
+            await session.execute(
+                sa.insert(models.User).values(id=USER_ID, first_name=message.text)
+            )
+            database.on_commit(session, lambda: committed.append(message.text))
+        if message.text == "fail":
+            raise RuntimeError("handler failed")
+
+    @dispatcher.errors_handler()
+    async def errors_handler(update: types.Update, exception: Exception):
+        return True
+
+    committed.clear()
+    yield dispatcher
+    async with database.sessionmaker.begin() as session:
+        await session.execute(sa.delete(models.User).where(models.User.id == USER_ID))
+    await bot.session.close()
+
+
+async def saved_name():
+    async with database.sessionmaker() as session:
+        return await session.scalar(
+            sa.select(models.User.first_name).where(models.User.id == USER_ID)
+        )
+
+
+@pytest.mark.database
+@pytest.mark.asyncio
+async def test_update_session_committed(dispatcher):
+    await dispatcher.process_updates([message_update(1, "ok")])
+    assert await saved_name() == "ok"
+    assert committed == ["ok"]
+
+
+@pytest.mark.database
+@pytest.mark.asyncio
+async def test_update_session_rolled_back_on_handled_error(dispatcher):
+    await dispatcher.process_updates([message_update(1, "fail")])
+    assert await saved_name() is None
+    assert committed == []
@@ -0,0 +1,94 @@
+import math
+import random
+
+import pytest
+
+from cradlex import geo
+
+
+def brute_force_nearest(index, point, count, keys=None):
+    scale = math.cos(math.radians(point[0]))
+    return sorted(
+        (key for key in index.points if keys is None or key in keys),
+        key=lambda key: (
+            (index.points[key][0] - point[0]) ** 2
+            + ((index.points[key][1] - point[1]) * scale) ** 2
+        ),
+    )[:count]
+
+
+def random_index(rng, size, center, spread):
+    index = geo.GridIndex()
+    for key in range(size):
+        index.set(
+            key,
+            (
+                center[0] + rng.uniform(-spread, spread),
+                center[1] + rng.uniform(-spread, spread),
+            ),
+        )
+    return index
+
+
+def test_distance():
+    moscow = (55.7558, 37.6173)
+    saint_petersburg = (59.9343, 30.3351)
+    assert geo.distance(moscow, moscow) == 0
+    assert geo.distance(moscow, saint_petersburg) == pytest.approx(634, abs=2)
+
+
+@pytest.mark.parametrize(
+    "spread",
+    [
+        0.3,  # city: many points in each cell
+        20.0,  # country: sparse cells, far rings
+        0.01,  # single cell
+    ],
+)
+def test_nearest_matches_brute_force(spread):
+    rng = random.Random(spread)
+    center = (55.75, 37.62)
+    index = random_index(rng, 5000, center, spread)
+    for _i in range(50):
+        point = (
+            center[0] + rng.uniform(-1, 1) * min(2 * spread, 30),
+            center[1] + rng.uniform(-2 * spread, 2 * spread),
+        )
+        count = rng.choice([1, 10, 100])
+        assert index.nearest(point, count) == brute_force_nearest(index, point, count)
+
+
+def test_nearest_filters_keys():
+    rng = random.Random(1)
+    index = random_index(rng, 2000, (55.75, 37.62), 0.3)
+    keys = set(rng.sample(range(2000), 50))
+    point = (55.75, 37.62)
+    assert index.nearest(point, 10, keys) == brute_force_nearest(index, point, 10, keys)
+    assert index.nearest(point, 100, keys) == brute_force_nearest(
+        index, point, 100, keys
+    )
+    assert index.nearest(point, 10, set()) == []
+
+
+def test_nearest_far_from_all_points():
+    rng = random.Random(2)
+    index = random_index(rng, 100, (55.75, 37.62), 0.3)
+    point = (-33.87, 151.21)
+    assert index.nearest(point, 5) == brute_force_nearest(index, point, 5)
+
+
+def test_nearest_after_moves_and_removals():
+    index = geo.GridIndex()
+    index.set(1, (55.75, 37.62))
+    index.set(2, (55.76, 37.62))
+    index.set(3, (55.90, 37.62))
+    assert index.nearest((55.75, 37.62), 2) == [1, 2]
+    index.set(1, (56.50, 37.62))
+    index.remove(2)
+    index.remove(4)
+    assert len(index) == 2
+    assert index.nearest((55.75, 37.62), 5) == [3, 1]
+    index.remove(1)
+    index.remove(3)
+    assert not index.cells
+    assert index.nearest((55.75, 37.62), 5) == []
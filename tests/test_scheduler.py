@@ -0,0 +1,158 @@
+import datetime
+
+import pytest
+import sqlalchemy as sa
+
+from cradlex import config
+from cradlex import database
+from cradlex import models
+from cradlex import scheduler
+from cradlex.dispatch import workers
+
+
+WORKER_ID = 900000002
+
+
+@pytest.fixture
+async def task_ids():
+    """Create worker with a task due ``SCHEDULER_RELEASE_DELAY`` ago and
+    yield IDs of the overdue task and of a recent one."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    release_delay = datetime.timedelta(seconds=config.SCHEDULER_RELEASE_DELAY)
+    async with database.sessionmaker.begin() as session:
+        await session.execute(
+            sa.insert(models.User).values(id=WORKER_ID, first_name="Worker")
+        )
+        await session.execute(
+            sa.insert(models.Worker).values(
+                id=WORKER_ID, phone="+79000000002", name="Worker", skill="no_repair"
+            )
+        )
+        cursor = await session.execute(
+            sa.insert(models.Task)
+            .values(
+                [
+                    {"worker_id": WORKER_ID, "time": now - 2 * release_delay},
+                    {"worker_id": WORKER_ID, "time": now},
+                ]
+            )
+            .returning(models.Task.id)
+        )
+        overdue_task_id, recent_task_id = cursor.scalars().all()
+    yield overdue_task_id, recent_task_id
+    async with database.sessionmaker.begin() as session:
+        await session.execute(
+            sa.update(models.Worker)
+            .values(task_id=None)
+            .where(models.Worker.id == WORKER_ID)
+        )
+        await session.execute(
+            sa.delete(models.OutboxMessage).where(
+                models.OutboxMessage.chat_id == WORKER_ID
+            )
+        )
+        await session.execute(
+            sa.delete(models.Task).where(models.Task.worker_id == WORKER_ID)
+        )
+        await session.execute(
+            sa.delete(models.Worker).where(models.Worker.id == WORKER_ID)
+        )
+        await session.execute(sa.delete(models.User).where(models.User.id == WORKER_ID))
+    workers.set_busy(WORKER_ID)
+
+
+async def take(task_id: str) -> None:
+    async with database.sessionmaker.begin() as session:
+        await session.execute(
+            sa.update(models.Worker)
+            .values(task_id=task_id)
+            .where(models.Worker.id == WORKER_ID)
+        )
+    workers.set_busy(WORKER_ID)
+
+
+async def current_task_id():
+    async with database.sessionmaker() as session:
+        return await session.scalar(
+            sa.select(models.Worker.task_id).where(models.Worker.id == WORKER_ID)
+        )
+
+
+@pytest.mark.database
+@pytest.mark.asyncio
+async def test_worker_of_overdue_task_released(task_ids):
+    await take(task_ids[0])
+    await scheduler.release_workers()
+    assert await current_task_id() is None
+    assert WORKER_ID in workers.idle["no_repair"]
+    async with database.sessionmaker() as session:
+        notified = await session.scalar(
+            sa.select(sa.func.count()).where(models.OutboxMessage.chat_id == WORKER_ID)
+        )
+    assert notified == 1
+
+
+@pytest.mark.database
+@pytest.mark.asyncio
+async def test_worker_of_recent_task_kept(task_ids):
+    await take(task_ids[1])
+    await scheduler.release_workers()
+    assert await current_task_id() == task_ids[1]
+    assert WORKER_ID not in workers.idle["no_repair"]
+
+
+@pytest.mark.database
+@pytest.mark.asyncio
+async def test_offers_of_expired_task_swept(task_ids):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    async with database.sessionmaker.begin() as session:
+        cursor = await session.execute(
+            sa.insert(models.Task)
+            .values(
+                [
+                    {"time": now - datetime.timedelta(hours=1)},
+                    {"time": now + datetime.timedelta(hours=1)},
+                ]
+            )
+            .returning(models.Task.id)
+        )
+        offered_task_ids = cursor.scalars().all()
+        await session.execute(
+            sa.insert(models.TaskMessage).values(
+                [
+                    {"id": message_id, "task_id": task_id, "worker_id": WORKER_ID}
+                    for message_id, task_id in enumerate(offered_task_ids, start=1)
+                ]
+            )
+        )
+    try:
+        await scheduler.sweep()
+        async with database.sessionmaker() as session:
+            offers_cursor = await session.execute(
+                sa.select(models.TaskMessage.task_id).where(
+                    models.TaskMessage.worker_id == WORKER_ID
+                )
+            )
+            assert offers_cursor.scalars().all() == [offered_task_ids[1]]
+            retractions_cursor = await session.execute(
+                sa.select(models.OutboxMessage.task_id).where(
+                    models.OutboxMessage.chat_id == WORKER_ID,
+                    models.OutboxMessage.method == "delete_message",
+                )
+            )
+            assert retractions_cursor.scalars().all() == [offered_task_ids[0]]
+    finally:
+        async with database.sessionmaker.begin() as session:
+            await session.execute(
+                sa.delete(models.OutboxMessage).where(
+                    models.OutboxMessage.chat_id == WORKER_ID
+                )
+            )
+            await session.execute(
+                sa.delete(models.TaskMessage).where(
+                    models.TaskMessage.worker_id == WORKER_ID
+                )
+            )
+            await session.execute(
+                sa.delete(models.Task).where(models.Task.id.in_(offered_task_ids))
+            )
@@ -0,0 +1,123 @@
+import pytest
+import sqlalchemy as sa
+
+from cradlex import database
+from cradlex import models
+from cradlex.storage import SnapshotMemoryStorage
+from cradlex.storage import SQLiteStorage
+
+
+USER_ID = 900000003
+OTHER_USER_ID = 900000004
+
+
+@pytest.fixture(
+    params=[
+        "memory",
+        "snapshot",
+        "sqlite",
+        pytest.param("postgres", marks=pytest.mark.database),
+    ]
+)
+async def storage(request, tmp_path):
+    if request.param == "memory":
+        storage = SnapshotMemoryStorage()
+    elif request.param == "snapshot":
+        storage = SnapshotMemoryStorage(str(tmp_path / "snapshot.json"))
+    elif request.param == "sqlite":
+        storage = SQLiteStorage(str(tmp_path / "storage.sqlite"))
+    else:
+        # State is stored in users table, so users must exist.
+        async with database.sessionmaker.begin() as session:
+            await session.execute(
+                sa.insert(models.User).values(
+                    [
+                        {"id": USER_ID, "first_name": "User"},
+                        {"id": OTHER_USER_ID, "first_name": "Other"},
+                    ]
+                )
+            )
+        storage = database.PostgreStorage()
+    yield storage
+    await storage.close()
+    await storage.wait_closed()
+    if request.param == "postgres":
+        async with database.sessionmaker.begin() as session:
+            await session.execute(
+                sa.delete(models.User).where(
+                    models.User.id.in_([USER_ID, OTHER_USER_ID])
+                )
+            )
+
+
+@pytest.mark.asyncio
+async def test_empty(storage):
+    assert await storage.get_state(chat=USER_ID, user=USER_ID) is None
+    assert await storage.get_data(chat=USER_ID, user=USER_ID) == {}
+
+
+@pytest.mark.asyncio
+async def test_set_state(storage):
+    await storage.set_data(chat=USER_ID, user=USER_ID, data={"key": "value"})
+    await storage.set_state(chat=USER_ID, user=USER_ID, state="Registration:name")
+    assert await storage.get_state(chat=USER_ID, user=USER_ID) == "Registration:name"
+    assert await storage.get_data(chat=USER_ID, user=USER_ID) == {"key": "value"}
+    assert await storage.get_state(chat=OTHER_USER_ID, user=OTHER_USER_ID) is None
+
+
+@pytest.mark.asyncio
+async def test_set_data(storage):
+    await storage.set_state(chat=USER_ID, user=USER_ID, state="Registration:name")
+    await storage.set_data(chat=USER_ID, user=USER_ID, data={"key": "value"})
+    await storage.set_data(chat=USER_ID, user=USER_ID, data={"other": 1})
+    assert await storage.get_data(chat=USER_ID, user=USER_ID) == {"other": 1}
+    assert await storage.get_state(chat=USER_ID, user=USER_ID) == "Registration:name"
+
+
+@pytest.mark.asyncio
+async def test_update_data(storage):
+    await storage.set_data(
+        chat=USER_ID, user=USER_ID, data={"key": "value", "other": 1}
+    )
+    await storage.update_data(chat=USER_ID, user=USER_ID, data={"other": 2}, new=[1, 2])
+    assert await storage.get_data(chat=USER_ID, user=USER_ID) == {
+        "key": "value",
+        "other": 2,
+        "new": [1, 2],
+    }
+
+
+@pytest.mark.asyncio
+async def test_reset_state(storage):
+    await storage.set_state(chat=USER_ID, user=USER_ID, state="Registration:name")
+    await storage.set_data(chat=USER_ID, user=USER_ID, data={"key": "value"})
+    await storage.reset_state(chat=USER_ID, user=USER_ID, with_data=False)
+    assert await storage.get_state(chat=USER_ID, user=USER_ID) is None
+    assert await storage.get_data(chat=USER_ID, user=USER_ID) == {"key": "value"}
+    await storage.set_state(chat=USER_ID, user=USER_ID, state="Registration:name")
+    await storage.reset_state(chat=USER_ID, user=USER_ID)
+    assert await storage.get_state(chat=USER_ID, user=USER_ID) is None
+    assert await storage.get_data(chat=USER_ID, user=USER_ID) == {}
+
+
+@pytest.mark.asyncio
+async def test_snapshot_round_trip(tmp_path):
+    filename = str(tmp_path / "snapshot.json")
+    storage = SnapshotMemoryStorage(filename)
+    await storage.set_state(chat=USER_ID, user=USER_ID, state="Registration:name")
+    await storage.set_data(chat=USER_ID, user=USER_ID, data={"key": "value"})
+    await storage.close()
+    restored = SnapshotMemoryStorage(filename)
+    assert await restored.get_state(chat=USER_ID, user=USER_ID) == "Registration:name"
+    assert await restored.get_data(chat=USER_ID, user=USER_ID) == {"key": "value"}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_persistence(tmp_path):
+    filename = str(tmp_path / "storage.sqlite")
+    storage = SQLiteStorage(filename)
+    await storage.update_data(chat=USER_ID, user=USER_ID, key="value")
+    await storage.close()
+    restored = SQLiteStorage(filename)
+    assert await restored.get_data(chat=USER_ID, user=USER_ID) == {"key": "value"}
+    await restored.close()
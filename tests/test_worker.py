@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+
+import pytest
+import sqlalchemy as sa
+
+from cradlex import database
+from cradlex import models
+from cradlex.handlers.worker import claim_task
+
+
+FIRST_WORKER_ID = 900000100
+#: Number of workers taking the same task at once. Each one holds a
+#: connection, so it must fit into the connection pool.
+WORKERS = 20
+
+
+@pytest.fixture
+async def worker_ids():
+    worker_ids = [FIRST_WORKER_ID + offset for offset in range(WORKERS)]
+    async with database.sessionmaker.begin() as session:
+        await session.execute(
+            sa.insert(models.User).values(
+                [{"id": worker_id, "first_name": "Worker"} for worker_id in worker_ids]
+            )
+        )
+        await session.execute(
+            sa.insert(models.Worker).values(
+                [
+                    {
+                        "id": worker_id,
+                        "phone": f"+7900{worker_id % 10000000:07d}",
+                        "name": "Worker",
+                        "skill": "no_repair",
+                    }
+                    for worker_id in worker_ids
+                ]
+            )
+        )
+    yield worker_ids
+    async with database.sessionmaker.begin() as session:
+        await session.execute(
+            sa.update(models.Worker)
+            .values(task_id=None)
+            .where(models.Worker.id.in_(worker_ids))
+        )
+        await session.execute(
+            sa.delete(models.Task).where(models.Task.worker_id.in_(worker_ids))
+        )
+        await session.execute(
+            sa.delete(models.Worker).where(models.Worker.id.in_(worker_ids))
+        )
+        await session.execute(
+            sa.delete(models.User).where(models.User.id.in_(worker_ids))
+        )
+
+
+async def create_task(
+    time: datetime.timedelta = datetime.timedelta(hours=1), cancelled: bool = False
+) -> str:
+    """Create untaken task due in ``time``."""
+    async with database.sessionmaker.begin() as session:
+        return await session.scalar(
+            sa.insert(models.Task)
+            .values(
+                time=datetime.datetime.now(datetime.timezone.utc) + time,
+                cancelled=cancelled,
+            )
+            .returning(models.Task.id)
+        )
+
+
+async def delete_task(task_id: str) -> None:
+    async with database.sessionmaker.begin() as session:
+        await session.execute(sa.delete(models.Task).where(models.Task.id == task_id))
+
+
+@pytest.mark.database
+@pytest.mark.asyncio
+async def test_concurrent_claims(worker_ids):
+    task_id = await create_task()
+    errors = await asyncio.gather(
+        *(claim_task(worker_id, task_id) for worker_id in worker_ids)
+    )
+    assert errors.count(None) == 1
+    assert errors.count("already_taken") == WORKERS - 1
+    winner_id = worker_ids[errors.index(None)]
+    async with database.sessionmaker() as session:
+        assert (
+            await session.scalar(
+                sa.select(models.Task.worker_id).where(models.Task.id == task_id)
+            )
+            == winner_id
+        )
+        busy_cursor = await session.execute(
+            sa.select(models.Worker.id, models.Worker.task_id).where(
+                models.Worker.id.in_(worker_ids),
+                models.Worker.task_id != None,  # noqa: E711
+            )
+        )
+        assert busy_cursor.all() == [(winner_id, task_id)]
+
+
+@pytest.mark.database
+@pytest.mark.asyncio
+async def test_busy_worker_claim(worker_ids):
+    first_task_id = await create_task()
+    second_task_id = await create_task()
+    assert await claim_task(worker_ids[0], first_task_id) is None
+    assert await claim_task(worker_ids[0], second_task_id) == "worker_busy"
+    assert await claim_task(worker_ids[1], second_task_id) is None
+
+
+@pytest.mark.database
+@pytest.mark.asyncio
+async def test_unavailable_task_claim(worker_ids):
+    cancelled_task_id = await create_task(cancelled=True)
+    expired_task_id = await create_task(-datetime.timedelta(hours=1))
+    try:
+        assert await claim_task(worker_ids[0], cancelled_task_id) == "cancelled"
+        assert await claim_task(worker_ids[0], expired_task_id) == "expired"
+        assert (
+            await claim_task(worker_ids[0], "00000000-0000-0000-0000-000000000000")
+            == "not_exists"
+        )
+    finally:
+        await delete_task(cancelled_task_id)
+        await delete_task(expired_task_id)